@@ -0,0 +1,282 @@
+import argparse
+import curses
+import importlib
+import json
+import logging
+import os
+import random
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+SIZES = [1000, 10000, 100000]
+APPS = ["todocloud", "todo"]
+REPEAT = 5
+OUTPUT_FILE = 'bench_output.txt'
+SCREEN_SIZE = (40, 120)
+SAVE_BATCH = 100  # Todos changed before each timed save_todos
+MAX_SUBTODOS = 3  # Todo n gets n % (MAX_SUBTODOS + 1) subtodos
+FILTER_PATTERN = "bymlk"  # Typed one character at a time into the '?' filter
+WORDS = ["buy", "milk", "call", "mom", "fix", "bug", "write", "report", "review", "patch",
+         "book", "flight", "pay", "rent", "clean", "desk", "plan", "trip", "read", "paper"]
+
+# handle_input commands timed on a shared app; {mid} is the todo in the middle of the list
+COMMANDS = {
+    "todocloud": [
+        ("add", "benchmark todo"),
+        ("toggle", "{mid}"),
+        ("add_subtodo", "5 benchmark subtodo"),
+        ("toggle_subtodo", "5a"),
+        (":d", ":d {mid}"),
+        (":p", ":p {mid}"),
+        (":b", ":b {mid}"),
+        (":i", ":i {mid}"),
+        (":e", ":e {mid}"),
+        (":x", ":x {mid}"),
+        (":theme", ":theme light"),
+        ("/query", "/buy mi"),
+        (":u", ":u"),
+        (":r", ":r"),
+    ],
+    "todo": [
+        ("add", "benchmark todo"),
+        ("toggle", "{mid}"),
+        (":d", ":d {mid}"),
+        (":p", ":p {mid}"),
+        (":x", ":x {mid}"),
+        (":theme", ":theme light"),
+    ],
+}
+
+class HeadlessScreen:
+    # Stands in for the curses window passed to ToDoApp
+    def __init__(self, height, width):
+        self.height = height
+        self.width = width
+        self.writes = 0
+
+    def getmaxyx(self):
+        return (self.height, self.width)
+
+    def addstr(self, y, x, text, attr=0):
+        if not (0 <= y < self.height and 0 <= x < self.width):
+            raise curses.error("addstr() returned ERR")
+        self.writes += 1
+
+    def getch(self):
+        return -1
+
+    def move(self, y, x):
+        pass
+
+    def clear(self):
+        pass
+
+    def refresh(self):
+        pass
+
+    def noutrefresh(self):
+        pass
+
+    def timeout(self, delay):
+        pass
+
+def install_headless_curses():
+    # Only what ToDoApp calls outside the window; these need initscr otherwise
+    for name in ("start_color", "use_default_colors", "init_color", "init_pair", "curs_set", "echo", "noecho", "doupdate"):
+        setattr(curses, name, lambda *args: None)
+    curses.color_pair = lambda n: n << 8
+
+def generate_db(path, size, subtodos):
+    rng = random.Random(size)
+    conn = sqlite3.connect(path)
+    with conn:
+        cursor = conn.cursor()
+        cursor.execute('''CREATE TABLE todos (
+                            id INTEGER PRIMARY KEY,
+                            content TEXT,
+                            highlighted INTEGER,
+                            priority INTEGER)''')
+        cursor.executemany('INSERT INTO todos (id, content, highlighted, priority) VALUES (?, ?, ?, ?)',
+                           ((n, ' '.join(rng.choices(WORDS, k=rng.randint(2, 6))), int(n % 7 == 0), int(n % 11 == 0))
+                            for n in range(1, size + 1)))
+        if subtodos:
+            cursor.execute('''CREATE TABLE subtodos (
+                                id INTEGER PRIMARY KEY,
+                                parent_id INTEGER,
+                                content TEXT,
+                                highlighted INTEGER,
+                                priority INTEGER,
+                                FOREIGN KEY(parent_id) REFERENCES todos(id))''')
+            cursor.executemany('INSERT INTO subtodos (parent_id, content, highlighted, priority) VALUES (?, ?, ?, ?)',
+                               ((n, ' '.join(rng.choices(WORDS, k=rng.randint(2, 4))), int(n % 5 == 0), 0)
+                                for n in range(1, size + 1) for _ in range(n % (MAX_SUBTODOS + 1))))
+    conn.close()
+
+class Bench:
+    def __init__(self, workdir, repeat, out):
+        self.workdir = workdir
+        self.repeat = repeat
+        self.out = out
+        self.base_dbs = {}
+
+    def base_db(self, module, app_name, size):
+        key = (app_name, size)
+        if key not in self.base_dbs:
+            path = os.path.join(self.workdir, f"{app_name}-{size}.base.db")
+            generate_db(path, size, app_name == "todocloud")
+            # Opened the way the app opens it and indexed once here, so load_todos is timed
+            # against a database the app has already set up
+            if hasattr(module, "open_database"):
+                conn = module.open_database(path)
+            else:
+                conn = sqlite3.connect(path)
+            with conn:
+                if hasattr(module, "SUBTODO_INDEX"):
+                    conn.execute(module.SUBTODO_INDEX)
+                if hasattr(module, "create_search_index"):
+                    module.create_search_index(conn.cursor())
+            conn.close()
+            self.base_dbs[key] = path
+        return self.base_dbs[key]
+
+    def open_app(self, module, app_name, size):
+        db_file = os.path.join(self.workdir, f"{app_name}-{size}.db")
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(db_file + suffix):
+                os.remove(db_file + suffix)
+        shutil.copyfile(self.base_db(module, app_name, size), db_file)
+        module.DB_FILE = db_file
+
+        class BenchApp(module.ToDoApp):
+            def initialize_database(self):
+                self.db_code = "bench"
+                self.db_file = db_file
+                self.create_db_if_not_exists()
+
+            def load_todos(self):
+                start = time.perf_counter()
+                super().load_todos()
+                self.load_seconds = time.perf_counter() - start
+                # Rows a streaming loader leaves for the UI loop; the benchmarks need the whole list
+                start = time.perf_counter()
+                if hasattr(self, "finish_loading"):
+                    self.finish_loading()
+                self.rest_seconds = time.perf_counter() - start
+
+            def run(self):
+                pass
+
+        return BenchApp(HeadlessScreen(*SCREEN_SIZE))
+
+    def close_app(self, app):
+        app.close_connection()
+        if hasattr(app, "sync_worker"):
+            app.sync_worker.stop(0)
+        if hasattr(app, "save_worker"):
+            app.save_worker.stop()
+
+    def report(self, app_name, size, op, samples):
+        record = {
+            "app": app_name,
+            "size": size,
+            "op": op,
+            "runs": len(samples),
+            "min_ms": round(min(samples) * 1000, 3),
+            "median_ms": round(statistics.median(samples) * 1000, 3),
+            "mean_ms": round(statistics.mean(samples) * 1000, 3),
+        }
+        line = json.dumps(record)
+        print(line)
+        self.out.write(line + "\n")
+        self.out.flush()
+
+    def timed(self, action):
+        start = time.perf_counter()
+        action()
+        return time.perf_counter() - start
+
+    def run_app(self, app_name, size):
+        module = importlib.import_module(app_name)
+        mid = size // 2
+
+        # Operations that change the list get a fresh copy of the database each run
+        load_samples, rest_samples, range_samples = [], [], []
+        span = max(size // 10, 1)
+        for _ in range(self.repeat):
+            app = self.open_app(module, app_name, size)
+            load_samples.append(app.load_seconds)
+            rest_samples.append(app.rest_seconds)
+            range_samples.append(self.timed(lambda: app.handle_input(f":x {mid - span // 2}-{mid + span - span // 2 - 1}")))
+            self.close_app(app)
+        self.report(app_name, size, "load_todos", load_samples)
+        if hasattr(module.ToDoApp, "finish_loading"):
+            self.report(app_name, size, "load_rest", rest_samples)
+        self.report(app_name, size, f"delete_range_{span}", range_samples)
+
+        app = self.open_app(module, app_name, size)
+        app.draw()
+        self.report(app_name, size, "draw", [self.timed(lambda: app.draw(str(n))) for n in range(self.repeat)])
+        if hasattr(app, "invalidate"):
+            samples = []
+            for _ in range(self.repeat):
+                app.invalidate()
+                samples.append(self.timed(app.draw))
+            self.report(app_name, size, "draw_full", samples)
+
+        samples = []
+        for n in range(self.repeat):
+            for idx in range(n * SAVE_BATCH, (n + 1) * SAVE_BATCH):
+                if hasattr(app, "toggle_item"):
+                    app.toggle_item(idx % size, module.PRIORITY)
+                else:
+                    app.prioritize_item(idx % size)
+            samples.append(self.timed(app.save_todos))
+        self.report(app_name, size, f"save_todos_{SAVE_BATCH}", samples)
+
+        if hasattr(app, "update_filter"):
+            first_samples, next_samples = [], []
+            for _ in range(self.repeat):
+                app.fuzzy.reset()
+                first_samples.append(self.timed(lambda: app.update_filter("?" + FILTER_PATTERN[0])))
+                for end in range(2, len(FILTER_PATTERN) + 1):
+                    next_samples.append(self.timed(lambda: app.update_filter("?" + FILTER_PATTERN[:end])))
+                app.update_filter("")
+            self.report(app_name, size, "filter_first_key", first_samples)
+            self.report(app_name, size, "filter_next_key", next_samples)
+
+        for name, command in COMMANDS[app_name]:
+            command = command.format(mid=mid)
+            self.report(app_name, size, f"handle_input {name}",
+                        [self.timed(lambda: app.handle_input(command)) for _ in range(self.repeat)])
+        self.close_app(app)
+
+def main():
+    parser = argparse.ArgumentParser(description="Time ToDoApp operations against generated databases.")
+    parser.add_argument("--sizes", type=lambda s: [int(n) for n in s.split(",")], default=SIZES)
+    parser.add_argument("--apps", type=lambda s: s.split(","), default=APPS)
+    parser.add_argument("--repeat", type=int, default=REPEAT)
+    parser.add_argument("--output", default=OUTPUT_FILE)
+    args = parser.parse_args()
+
+    unknown = [name for name in args.apps if name not in COMMANDS]
+    if unknown:
+        parser.error(f"unknown app: {', '.join(unknown)}")
+
+    install_headless_curses()
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    with tempfile.TemporaryDirectory() as workdir, open(args.output, "w") as out:
+        for app_name in args.apps:
+            # Both variants log to the same "todo" logger; keep it out of the working tree
+            importlib.import_module(app_name).setup_logger(os.path.join(workdir, "error.log"))
+        bench = Bench(workdir, args.repeat, out)
+        for size in args.sizes:
+            for app_name in args.apps:
+                bench.run_app(app_name, size)
+        logging.shutdown()  # Flush the buffered log while workdir still exists
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,30 @@
 import curses
 import sqlite3
 import os
+import logging
+import logging.handlers
+import threading
+import time
 
 DB_FILE = 'todos.db'  # Usa un percorso relativo per il database nella stessa cartella dell'app
 
+# Applied to the long-lived connection opened by ToDoApp.get_connection
+DB_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",  # Safe with WAL, fsyncs only at checkpoints
+    "cache_size": -8000,  # In KiB when negative
+    "mmap_size": 64 * 1024 * 1024,
+}
+DB_CACHED_STATEMENTS = 256
+
+LOG_FILE = 'error.log'
+LOG_MAX_BYTES = 1024 * 1024  # Rotate the log file past this size
+LOG_BACKUPS = 3
+LOG_BUFFER_RECORDS = 200  # Records held in memory between writes
+LOG_FLUSH_INTERVAL = 2.0  # Seconds between background flushes
+LOG_REPEAT_WINDOW = 60.0  # Identical messages inside this window are folded into one
+LOG_REPEAT_KEYS = 256
+
 COLOR_MAP = {
     "black": curses.COLOR_BLACK,
     "red": curses.COLOR_RED,
@@ -35,16 +56,175 @@ THEMES = {
 
 COMMANDS = [":d ", ":p ", ":x ", ":q ", ":theme "]
 
+class RepeatFilter(logging.Filter):
+    # Drops a message seen again within LOG_REPEAT_WINDOW and counts it on the next one let through
+    def __init__(self, window=LOG_REPEAT_WINDOW):
+        super().__init__()
+        self.window = window
+        self.seen = {}  # (level, message) -> [time let through, suppressed count, last suppressed record]
+        self.evicted = []  # Summaries for keys pushed out while they still had a count
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        key = (record.levelno, record.getMessage())
+        with self.lock:
+            entry = self.seen.pop(key, None)
+            if entry and record.created - entry[0] < self.window:
+                entry[1] += 1
+                entry[2] = record
+                self.seen[key] = entry
+                return False
+            if entry and entry[1]:
+                record.msg = f"{key[1]} (repeated {entry[1]} more times)"
+                record.args = None
+            self.seen[key] = [record.created, 0, None]
+            if len(self.seen) > LOG_REPEAT_KEYS:
+                oldest = next(iter(self.seen))
+                entry = self.seen.pop(oldest)
+                if entry[1]:
+                    self.evicted.append(self.summary(oldest, entry))
+        return True
+
+    def pending(self):
+        # Counts not reported yet, so a flush or close does not lose them
+        with self.lock:
+            records, self.evicted = self.evicted, []
+            for key, entry in self.seen.items():
+                if entry[1]:
+                    records.append(self.summary(key, entry))
+                    entry[1] = 0
+        return records
+
+    @staticmethod
+    def summary(key, entry):
+        record = entry[2]
+        record.msg = f"{key[1]} (repeated {entry[1]} more times)"
+        record.args = None
+        return record
+
+class RepeatBuffer(logging.handlers.MemoryHandler):
+    # Writes out what RepeatFilter still holds on every flush, including the one on close
+    def __init__(self, capacity, repeats, **kwargs):
+        super().__init__(capacity, **kwargs)
+        self.repeats = repeats
+        self.addFilter(repeats)
+
+    def flush(self):
+        with self.lock:
+            self.buffer.extend(self.repeats.pending())
+            super().flush()
+
+def flush_periodically(handler, interval=LOG_FLUSH_INTERVAL):
+    while True:
+        time.sleep(interval)
+        handler.flush()
+
+def setup_logger(path=LOG_FILE):
+    logger = logging.getLogger("todo")
+    if logger.handlers:
+        return logger
+    file_handler = logging.handlers.RotatingFileHandler(
+        path, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUPS, encoding="utf-8", delay=True)
+    file_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s [%(threadName)s] %(message)s"))
+    # Only CRITICAL is written straight away, everything else waits for the buffer or the flusher
+    buffer = RepeatBuffer(LOG_BUFFER_RECORDS, RepeatFilter(), flushLevel=logging.CRITICAL, target=file_handler)
+    logger.addHandler(buffer)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    threading.Thread(target=flush_periodically, args=(buffer,), name="log-flush", daemon=True).start()
+    return logger
+
 def strikethrough(text):
     return ''.join(c + '\u0336' for c in text)
 
+def parse_indices(text):
+    # 1,3,5 or 2-6, as 0-based list positions
+    indices = []
+    for part in text.split(','):
+        if '-' in part:
+            start, end = map(int, part.split('-'))
+            indices.extend(range(start - 1, end))
+        else:
+            indices.append(int(part) - 1)
+    return indices
+
+def parse_refs(text):
+    # Like parse_indices, plus subtodo refs such as 3b; -> (indices, [(idx, sub_idx)])
+    indices, subrefs = [], []
+    for part in text.split(','):
+        part = part.strip()
+        if part[:-1].isdigit() and part[-1:].isalpha():
+            subrefs.append((int(part[:-1]) - 1, ord(part[-1]) - 97))
+        else:
+            indices.extend(parse_indices(part))
+    return indices, subrefs
+
+def open_database(db_file):
+    conn = sqlite3.connect(db_file, cached_statements=DB_CACHED_STATEMENTS)
+    for name, value in DB_PRAGMAS.items():
+        conn.execute(f"PRAGMA {name}={value}")
+    return conn
+
+class ChangeTracker:
+    # Rows touched since the last save, so save_todos only writes what changed
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.inserted_todos = {}  # todo_id -> content
+        self.updated_todos = set()
+        self.deleted_todos = set()
+        self.inserted_subtodos = {}  # subtodo_id -> (parent_id, content)
+        self.updated_subtodos = {}  # subtodo_id -> parent_id
+        self.deleted_subtodos = set()
+
+    def has_changes(self):
+        return bool(self.inserted_todos or self.updated_todos or self.deleted_todos or
+                    self.inserted_subtodos or self.updated_subtodos or self.deleted_subtodos)
+
+    def insert_todo(self, todo_id, content):
+        self.inserted_todos[todo_id] = content
+
+    def update_todo(self, todo_id):
+        if todo_id not in self.inserted_todos and todo_id not in self.deleted_todos:
+            self.updated_todos.add(todo_id)
+
+    def delete_todo(self, todo_id, subtodo_ids=()):
+        self.updated_todos.discard(todo_id)
+        if todo_id in self.inserted_todos:
+            del self.inserted_todos[todo_id]
+        else:
+            self.deleted_todos.add(todo_id)
+        # Pending writes for its children are superseded by the parent delete
+        for subtodo_id in subtodo_ids:
+            self.inserted_subtodos.pop(subtodo_id, None)
+            self.updated_subtodos.pop(subtodo_id, None)
+
+    def insert_subtodo(self, parent_id, subtodo_id, content):
+        self.inserted_subtodos[subtodo_id] = (parent_id, content)
+
+    def update_subtodo(self, parent_id, subtodo_id):
+        if subtodo_id not in self.inserted_subtodos and subtodo_id not in self.deleted_subtodos:
+            self.updated_subtodos[subtodo_id] = parent_id
+
+    def delete_subtodo(self, subtodo_id):
+        self.updated_subtodos.pop(subtodo_id, None)
+        if subtodo_id in self.inserted_subtodos:
+            del self.inserted_subtodos[subtodo_id]
+        else:
+            self.deleted_subtodos.add(subtodo_id)
+
 class ToDoApp:
     def __init__(self, stdscr):
         self.stdscr = stdscr
+        self.log = setup_logger()
         self.todos = []
         self.subtodos = {}  # Dictionary to hold subtasks
         self.highlighted = set()
         self.priorities = set()
+        self.changes = ChangeTracker()
+        self.conn = None
+        self.next_subtodo_id = 1
         self.current_theme = "dark"  # Default theme
         self.init_colors()
         self.create_db_if_not_exists()
@@ -75,11 +255,21 @@ class ToDoApp:
             self.background_color_pair = curses.color_pair(2)  # Use the same as text background
             self.current_theme = theme_name
 
+    def get_connection(self):
+        if self.conn is None:
+            self.conn = open_database(DB_FILE)
+        return self.conn
+
+    def close_connection(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
     def create_db_if_not_exists(self):
         try:
             if not os.path.exists(DB_FILE):
                 os.makedirs(os.path.dirname(DB_FILE), exist_ok=True)
-                conn = sqlite3.connect(DB_FILE)
+                conn = self.get_connection()
                 cursor = conn.cursor()
                 cursor.execute('''CREATE TABLE IF NOT EXISTS todos (
                                     id INTEGER PRIMARY KEY,
@@ -94,16 +284,15 @@ class ToDoApp:
                                     priority INTEGER,
                                     FOREIGN KEY(parent_id) REFERENCES todos(id))''')
                 conn.commit()
-                conn.close()
-                self.log_error("Database created successfully.")
+                self.log.info("Database created successfully.")
             else:
-                self.log_error("Database already exists.")
+                self.log.info("Database already exists.")
         except Exception as e:
-            self.log_error(f"Error creating database: {e}")
+            self.log.error(f"Error creating database: {e}")
 
     def load_todos(self):
         try:
-            conn = sqlite3.connect(DB_FILE)
+            conn = self.get_connection()
             cursor = conn.cursor()
             cursor.execute('''CREATE TABLE IF NOT EXISTS todos (
                                 id INTEGER PRIMARY KEY,
@@ -133,33 +322,51 @@ class ToDoApp:
                     self.subtodos[row[1]] = []
                 self.subtodos[row[1]].append((row[0], row[2]))  # Include ID with the content
                 if row[3]:
-                    self.highlighted.add(f"{row[1]}_{len(self.subtodos[row[1]]) - 1}")
+                    self.highlighted.add(f"{row[1]}_{row[0]}")
                 if row[4]:
-                    self.priorities.add(f"{row[1]}_{len(self.subtodos[row[1]]) - 1}")
+                    self.priorities.add(f"{row[1]}_{row[0]}")
+                self.next_subtodo_id = max(self.next_subtodo_id, row[0] + 1)
             
-            conn.close()
-            self.log_error("Todos and subtodos loaded successfully.")
+            self.log.info("Todos and subtodos loaded successfully.")
         except Exception as e:
-            self.log_error(f"Error loading todos: {e}")
+            self.log.error(f"Error loading todos: {e}")
 
     def save_todos(self):
+        if not self.changes.has_changes():
+            return
         try:
-            conn = sqlite3.connect(DB_FILE)
-            cursor = conn.cursor()
-            cursor.execute('DELETE FROM todos')
-            cursor.execute('DELETE FROM subtodos')
-            for i, (todo_id, todo) in enumerate(self.todos):
-                cursor.execute('INSERT INTO todos (id, content, highlighted, priority) VALUES (?, ?, ?, ?)',
-                               (todo_id, todo, int(f"{todo_id}" in self.highlighted), int(f"{todo_id}" in self.priorities)))
-                if todo_id in self.subtodos:
-                    for j, (subtodo_id, subtodo) in enumerate(self.subtodos[todo_id]):
-                        cursor.execute('INSERT INTO subtodos (id, parent_id, content, highlighted, priority) VALUES (?, ?, ?, ?, ?)',
-                                       (subtodo_id, todo_id, subtodo, int(f"{todo_id}_{j}" in self.highlighted), int(f"{todo_id}_{j}" in self.priorities)))
-            conn.commit()
-            conn.close()
-            self.log_error("Todos and subtodos saved successfully.")
+            changes = self.changes
+            conn = self.get_connection()
+            with conn:  # One transaction, one commit
+                cursor = conn.cursor()
+                cursor.executemany('DELETE FROM subtodos WHERE id = ?',
+                                   [(subtodo_id,) for subtodo_id in changes.deleted_subtodos])
+                cursor.executemany('DELETE FROM subtodos WHERE parent_id = ?',
+                                   [(todo_id,) for todo_id in changes.deleted_todos])
+                cursor.executemany('DELETE FROM todos WHERE id = ?',
+                                   [(todo_id,) for todo_id in changes.deleted_todos])
+                cursor.executemany('INSERT INTO todos (id, content, highlighted, priority) VALUES (?, ?, ?, ?)',
+                                   [(todo_id, todo) + self.todo_flags(todo_id)
+                                    for todo_id, todo in changes.inserted_todos.items()])
+                cursor.executemany('UPDATE todos SET highlighted = ?, priority = ? WHERE id = ?',
+                                   [self.todo_flags(todo_id) + (todo_id,) for todo_id in changes.updated_todos])
+                cursor.executemany('INSERT INTO subtodos (id, parent_id, content, highlighted, priority) VALUES (?, ?, ?, ?, ?)',
+                                   [(subtodo_id, parent_id, subtodo) + self.subtodo_flags(parent_id, subtodo_id)
+                                    for subtodo_id, (parent_id, subtodo) in changes.inserted_subtodos.items()])
+                cursor.executemany('UPDATE subtodos SET highlighted = ?, priority = ? WHERE id = ?',
+                                   [self.subtodo_flags(parent_id, subtodo_id) + (subtodo_id,)
+                                    for subtodo_id, parent_id in changes.updated_subtodos.items()])
+            changes.clear()
+            self.log.info("Todos and subtodos saved successfully.")
         except Exception as e:
-            self.log_error(f"Error saving todos: {e}")
+            self.log.error(f"Error saving todos: {e}")
+
+    def todo_flags(self, todo_id):
+        return (int(f"{todo_id}" in self.highlighted), int(f"{todo_id}" in self.priorities))
+
+    def subtodo_flags(self, parent_id, subtodo_id):
+        subtask_key = f"{parent_id}_{subtodo_id}"
+        return (int(subtask_key in self.highlighted), int(subtask_key in self.priorities))
 
     def fill_background(self):
         try:
@@ -167,7 +374,7 @@ class ToDoApp:
             for y in range(height):
                 self.stdscr.addstr(y, 0, " " * width, self.background_color_pair)
         except Exception as e:
-            self.log_error(f"Error filling background: {e}")
+            self.log.error(f"Error filling background: {e}")
 
     def draw(self, input_str="", suggestions=None, selected_suggestion_index=None):
         try:
@@ -197,7 +404,7 @@ class ToDoApp:
                     for j, (subtodo_id, subtodo) in enumerate(self.subtodos[todo_id]):
                         attr = self.text_color
                         display_text = subtodo
-                        subtask_key = f"{todo_id}_{j}"
+                        subtask_key = f"{todo_id}_{subtodo_id}"
                         if subtask_key in self.priorities:
                             attr |= curses.A_BOLD
                         if subtask_key in self.highlighted:
@@ -228,17 +435,21 @@ class ToDoApp:
             self.stdscr.clrtoeol()  # Clear the rest of the line
             self.stdscr.refresh()
         except Exception as e:
-            self.log_error(f"Error drawing screen: {e}")
+            self.log.error(f"Error drawing screen: {e}")
 
     def add_item(self, item):
         new_id = (self.todos[-1][0] + 1) if self.todos else 1
         self.todos.append((new_id, item))  # Add new todo with new ID
+        self.changes.insert_todo(new_id, item)
 
     def add_subitem(self, parent_id, item):
         if parent_id not in self.subtodos:
             self.subtodos[parent_id] = []
-        new_id = (self.subtodos[parent_id][-1][0] + 1) if self.subtodos[parent_id] else 1
+        # subtodos.id is the table's primary key, so it must be unique across parents
+        new_id = self.next_subtodo_id
+        self.next_subtodo_id += 1
         self.subtodos[parent_id].append((new_id, item))  # Add new subtodo with new ID
+        self.changes.insert_subtodo(parent_id, new_id, item)
 
     def highlight_item(self, idx):
         todo_id, _ = self.todos[idx]
@@ -246,13 +457,15 @@ class ToDoApp:
             self.highlighted.remove(f"{todo_id}")
         else:
             self.highlighted.add(f"{todo_id}")
+        self.changes.update_todo(todo_id)
 
     def highlight_subitem(self, parent_id, sub_idx):
-        subtask_key = f"{parent_id}_{sub_idx}"
+        subtask_key = self.subtask_key(parent_id, sub_idx)
         if subtask_key in self.highlighted:
             self.highlighted.remove(subtask_key)
         else:
             self.highlighted.add(subtask_key)
+        self.mark_subitem_changed(parent_id, sub_idx)
 
     def prioritize_item(self, idx):
         todo_id, _ = self.todos[idx]
@@ -260,27 +473,65 @@ class ToDoApp:
             self.priorities.remove(f"{todo_id}")
         else:
             self.priorities.add(f"{todo_id}")
+        self.changes.update_todo(todo_id)
 
     def prioritize_subitem(self, parent_id, sub_idx):
-        subtask_key = f"{parent_id}_{sub_idx}"
+        subtask_key = self.subtask_key(parent_id, sub_idx)
         if subtask_key in self.priorities:
             self.priorities.remove(subtask_key)
         else:
             self.priorities.add(subtask_key)
+        self.mark_subitem_changed(parent_id, sub_idx)
 
-    def delete_item(self, idx):
-        todo_id, _ = self.todos[idx]
-        del self.todos[idx]
-        if todo_id in self.subtodos:
-            del self.subtodos[todo_id]
-        self.highlighted = {i for i in self.highlighted if i != f"{todo_id}" and not str(i).startswith(f"{todo_id}_")}
-        self.priorities = {i for i in self.priorities if i != f"{todo_id}" and not str(i).startswith(f"{todo_id}_")}
-
-    def delete_subitem(self, parent_id, sub_idx):
+    def mark_subitem_changed(self, parent_id, sub_idx):
         if parent_id in self.subtodos and sub_idx < len(self.subtodos[parent_id]):
-            del self.subtodos[parent_id][sub_idx]
-            self.highlighted = {i for i in self.highlighted if i != f"{parent_id}_{sub_idx}"}
-            self.priorities = {i for i in self.priorities if i != f"{parent_id}_{sub_idx}"}
+            self.changes.update_subtodo(parent_id, self.subtodos[parent_id][sub_idx][0])
+
+    def subtask_key(self, parent_id, sub_idx):
+        # Keyed by the subtodo's id, so flags stay with it when siblings are deleted
+        return f"{parent_id}_{self.subtodos[parent_id][sub_idx][0]}"
+
+    def delete_rows(self, indices, subrefs):
+        # Positions are resolved to ids up front, then every list is rebuilt in one pass
+        todo_ids = {self.todos[idx][0] for idx in indices if 0 <= idx < len(self.todos)}
+        subtodo_ids = {}  # parent_id -> ids of the subtodos to drop
+        for idx, sub_idx in subrefs:
+            if 0 <= idx < len(self.todos):
+                parent_id = self.todos[idx][0]
+                siblings = self.subtodos.get(parent_id, [])
+                if 0 <= sub_idx < len(siblings) and parent_id not in todo_ids:
+                    subtodo_ids.setdefault(parent_id, set()).add(siblings[sub_idx][0])
+        dropped = set()  # Flag keys of every removed row
+        for parent_id, ids in subtodo_ids.items():
+            for subtodo_id in ids:
+                self.changes.delete_subtodo(subtodo_id)
+                dropped.add(f"{parent_id}_{subtodo_id}")
+            self.subtodos[parent_id] = [sub for sub in self.subtodos[parent_id] if sub[0] not in ids]
+        if todo_ids:
+            self.todos = [todo for todo in self.todos if todo[0] not in todo_ids]
+            for todo_id in todo_ids:
+                children = [subtodo_id for subtodo_id, _ in self.subtodos.pop(todo_id, [])]
+                self.changes.delete_todo(todo_id, children)
+                dropped.add(f"{todo_id}")
+                dropped.update(f"{todo_id}_{subtodo_id}" for subtodo_id in children)
+        for marks in (self.highlighted, self.priorities):
+            marks -= dropped
+
+    def toggle_items(self, refs, marks, toggle, toggle_sub):
+        # The batch ends up marked, or unmarked when every item in it already was
+        indices, subrefs = refs
+        indices = [idx for idx in dict.fromkeys(indices) if 0 <= idx < len(self.todos)]
+        subrefs = [(self.todos[idx][0], sub_idx) for idx, sub_idx in dict.fromkeys(subrefs)
+                   if 0 <= idx < len(self.todos) and 0 <= sub_idx < len(self.subtodos.get(self.todos[idx][0], []))]
+        keys = [f"{self.todos[idx][0]}" for idx in indices]
+        sub_keys = [self.subtask_key(parent_id, sub_idx) for parent_id, sub_idx in subrefs]
+        setting = not all(key in marks for key in keys + sub_keys)
+        for idx, key in zip(indices, keys):
+            if (key in marks) != setting:
+                toggle(idx)
+        for (parent_id, sub_idx), key in zip(subrefs, sub_keys):
+            if (key in marks) != setting:
+                toggle_sub(parent_id, sub_idx)
 
     def handle_input(self, input_str):
         try:
@@ -299,33 +550,17 @@ class ToDoApp:
                 self.highlight_subitem(self.todos[parent_idx][0], sub_idx)
             elif input_str.startswith(":d "):
                 try:
-                    idx = int(input_str[3:]) - 1
-                    self.highlight_item(idx)
+                    self.toggle_items(parse_refs(input_str[3:]), self.highlighted, self.highlight_item, self.highlight_subitem)
                 except ValueError:
                     pass
             elif input_str.startswith(":p "):
                 try:
-                    idx = int(input_str[3:]) - 1
-                    self.prioritize_item(idx)
+                    self.toggle_items(parse_refs(input_str[3:]), self.priorities, self.prioritize_item, self.prioritize_subitem)
                 except ValueError:
                     pass
             elif input_str.startswith(":x "):
                 try:
-                    ranges = input_str[3:].split(',')
-                    indices = []
-                    for range_str in ranges:
-                        if '-' in range_str:
-                            start, end = map(int, range_str.split('-'))
-                            indices.extend(range(start-1, end))
-                        else:
-                            if range_str[0].isdigit() and len(range_str) > 1 and range_str[1].isalpha():
-                                parent_idx = int(range_str[0]) - 1
-                                sub_idx = ord(range_str[1]) - 97
-                                self.delete_subitem(self.todos[parent_idx][0], sub_idx)
-                            else:
-                                indices.append(int(range_str) - 1)
-                    for idx in sorted(indices, reverse=True):
-                        self.delete_item(idx)
+                    self.delete_rows(*parse_refs(input_str[3:]))
                 except ValueError:
                     pass
             elif input_str.startswith(":theme "):
@@ -337,13 +572,14 @@ class ToDoApp:
                 self.add_subitem(self.todos[parent_idx][0], subitem)
             elif input_str.strip() == ":q":
                 self.save_todos()
+                self.close_connection()
                 return False  # Signal to exit the app
             else:
                 self.add_item(input_str)
             self.save_todos()  # Save todos after each modification
             return True
         except Exception as e:
-            self.log_error(f"Error handling input: {e}")
+            self.log.error(f"Error handling input: {e}")
             return True
 
     def get_suggestions(self, input_str):
@@ -351,10 +587,6 @@ class ToDoApp:
             return [cmd for cmd in COMMANDS if cmd.startswith(input_str)]
         return []
 
-    def log_error(self, message):
-        with open("error.log", "a") as log_file:
-            log_file.write(message + "\n")
-
     def run(self):
         curses.echo()
         input_str = ""
@@ -398,7 +630,6 @@ def main(stdscr):
     try:
         app = ToDoApp(stdscr)
     except Exception as e:
-        with open("error.log", "a") as log_file:
-            log_file.write(f"Critical error: {e}\n")
+        setup_logger().critical(f"Critical error: {e}")
 
 curses.wrapper(main)
@@ -1,3 +1,4 @@
+import argparse
 import curses
 import sqlite3
 import os
@@ -5,10 +6,106 @@ import requests
 import random
 import string
 import datetime
+import gzip
+import hashlib
+import json
+import re
+import shutil
+import signal
+import sys
+import tempfile
+import queue
+import threading
+import time
+import unicodedata
+import logging
+import logging.handlers
+from bisect import bisect_left
 
 DB_HOST = 'http://127.0.0.1:5000'
 UPLOAD_ENDPOINT = '/upload'
 UPLOAD_FOLDER = 'uploads'
+SYNC_ENDPOINT = '/sync'
+ID_RANDOM_BITS = 20  # Low bits of a new todo or subtodo id that are random
+CACHE_FOLDER = 'cache'  # Last copy of each database downloaded from or uploaded to the server
+LISTING_CACHE = os.path.join(CACHE_FOLDER, 'listing.cache')  # Database names on the server
+LISTING_TTL = 300  # Seconds before the cached listing is fetched again
+LISTING_PAGE = 200  # Names per listing request
+HTTP_TIMEOUT = (3.05, 30)  # Connect and read timeouts in seconds
+HTTP_POOL_SIZE = 4  # Keep-alive connections kept open to DB_HOST
+HTTP_GZIP_UPLOADS = False  # The server must accept Content-Encoding: gzip
+HTTP_RETRIES = 3
+HTTP_BACKOFF = 0.5  # Seconds before the first retry, doubled on each attempt
+POLL_INTERVAL_MS = 200  # How often the idle UI picks up sync results
+AUTOSAVE_DELAY_MS = 250  # Edits are written together once the first of them is this old
+AUTOSAVE_COMMANDS = 50  # ...or once this many commands changed something
+EXIT_SIGNALS = ("SIGTERM", "SIGHUP")  # Save before exiting on these; not every platform has both
+LOAD_CHUNK = 1000  # Todos read per pass of the UI loop while the list is still loading
+RENDER_CACHE_SIZE = 1024  # Prepared list rows kept between frames
+BRACKETED_PASTE = ('\033[?2004h', '\033[?2004l')  # Ask the terminal to mark pastes, and stop again
+PASTE_START = (27, 91, 50, 48, 48, 126)  # ESC [200~
+PASTE_END = (27, 91, 50, 48, 49, 126)  # ESC [201~
+PASTE_WAIT_MS = 200  # How long a paste that has started may pause before it is taken as ended
+
+# Applied to the long-lived connection opened by ToDoApp.get_connection
+DB_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",  # Safe with WAL, fsyncs only at checkpoints
+    "cache_size": -8000,  # In KiB when negative
+    "mmap_size": 64 * 1024 * 1024,
+}
+DB_CACHED_STATEMENTS = 256
+
+# Parent deletes and delta sync look subtodos up by parent_id
+SUBTODO_INDEX = 'CREATE INDEX IF NOT EXISTS subtodos_parent_id ON subtodos (parent_id)'
+
+# Row-level operations shared by save_todos, the local changelog and delta sync
+SYNC_OPS = {
+    "delete_subtodo": ['DELETE FROM subtodos WHERE id = ?'],
+    "delete_todo": ['DELETE FROM subtodos WHERE parent_id = ?', 'DELETE FROM todos WHERE id = ?'],
+    "insert_todo": ['INSERT OR REPLACE INTO todos (id, content, highlighted, priority) VALUES (?, ?, ?, ?)'],
+    "update_todo": ['UPDATE todos SET highlighted = ?, priority = ? WHERE id = ?'],
+    "insert_subtodo": ['INSERT OR REPLACE INTO subtodos (id, parent_id, content, highlighted, priority) VALUES (?, ?, ?, ?, ?)'],
+    "update_subtodo": ['UPDATE subtodos SET highlighted = ?, priority = ? WHERE id = ?'],
+}
+
+SYNC_SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS changelog (
+           seq INTEGER PRIMARY KEY,
+           op TEXT,
+           args TEXT)''',
+    '''CREATE TABLE IF NOT EXISTS sync_state (
+           key TEXT PRIMARY KEY,
+           value INTEGER)''',
+]
+
+# Undo history, one row per command; journal_log holds what was applied since the last save
+# and is replayed on startup when the app stopped before saving it
+JOURNAL_SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS journal (
+           step INTEGER PRIMARY KEY,
+           undo TEXT,
+           redo TEXT,
+           done INTEGER)''',
+    '''CREATE TABLE IF NOT EXISTS journal_log (
+           seq INTEGER PRIMARY KEY,
+           ops TEXT)''',
+]
+JOURNAL_STEPS = 100  # Commands that can be undone
+JOURNAL_OPS = {"restore_rows", "drop_rows", "set_flags"}  # ToDoApp methods a journal entry may call
+
+# Full-text index over both tables; rowid is id * 2 for a todo and id * 2 + 1 for a subtodo
+SEARCH_TABLES = {"todos": 0, "subtodos": 1}
+SEARCH_TOKENIZER = "unicode61 remove_diacritics 2"
+SEARCH_LIMIT = 100
+
+LOG_FILE = 'error.log'
+LOG_MAX_BYTES = 1024 * 1024  # Rotate the log file past this size
+LOG_BACKUPS = 3
+LOG_BUFFER_RECORDS = 200  # Records held in memory between writes
+LOG_FLUSH_INTERVAL = 2.0  # Seconds between background flushes
+LOG_REPEAT_WINDOW = 60.0  # Identical messages inside this window are folded into one
+LOG_REPEAT_KEYS = 256
 
 COLOR_MAP = {
     "black": curses.COLOR_BLACK,
@@ -40,40 +137,938 @@ THEMES = {
 }
 
 COMMANDS = {
-    ":d ": "done, completato",
-    ":p ": "priorità",
+    ":d ": "done, completato. 1,3,5 oppure 2-6",
+    ":p ": "priorità. 1,3,5 oppure 2-6",
     ":x ": "cancella rigo. 1,3,5 oppure 2-6",
     ":q ": "quit, chiudi app",
     ":theme ": "tema può essere 'dark' o 'light'",
-    ":b ": "evidenzia in grassetto una nota",
-    ":i ": "evidenzia in corsivo una nota",
+    ":b ": "evidenzia in grassetto. 1,3,5 oppure 2-6",
+    ":i ": "evidenzia in corsivo. 1,3,5 oppure 2-6",
     ":s ": "salva il database sul server HTTP",
-    ":check ": "controlla se il database è salvato sul server HTTP"
+    ":check ": "controlla se il database è salvato sul server HTTP",
+    ":e ": "mostra o nascondi i subtodo. 1,3,5 oppure 2-6",
+    ":u ": "annulla l'ultima modifica",
+    ":wrap ": "righe lunghe a capo ('on') o tagliate ('off')",
+    ":r ": "ripristina la modifica annullata",
+    "/": "cerca nei todo e nei subtodo",
+    "?": "filtra la lista mentre scrivi",
 }
 
+class RepeatFilter(logging.Filter):
+    # Drops a message seen again within LOG_REPEAT_WINDOW and counts it on the next one let through
+    def __init__(self, window=LOG_REPEAT_WINDOW):
+        super().__init__()
+        self.window = window
+        self.seen = {}  # (level, message) -> [time let through, suppressed count, last suppressed record]
+        self.evicted = []  # Summaries for keys pushed out while they still had a count
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        key = (record.levelno, record.getMessage())
+        with self.lock:
+            entry = self.seen.pop(key, None)
+            if entry and record.created - entry[0] < self.window:
+                entry[1] += 1
+                entry[2] = record
+                self.seen[key] = entry
+                return False
+            if entry and entry[1]:
+                record.msg = f"{key[1]} (repeated {entry[1]} more times)"
+                record.args = None
+            self.seen[key] = [record.created, 0, None]
+            if len(self.seen) > LOG_REPEAT_KEYS:
+                oldest = next(iter(self.seen))
+                entry = self.seen.pop(oldest)
+                if entry[1]:
+                    self.evicted.append(self.summary(oldest, entry))
+        return True
+
+    def pending(self):
+        # Counts not reported yet, so a flush or close does not lose them
+        with self.lock:
+            records, self.evicted = self.evicted, []
+            for key, entry in self.seen.items():
+                if entry[1]:
+                    records.append(self.summary(key, entry))
+                    entry[1] = 0
+        return records
+
+    @staticmethod
+    def summary(key, entry):
+        record = entry[2]
+        record.msg = f"{key[1]} (repeated {entry[1]} more times)"
+        record.args = None
+        return record
+
+class RepeatBuffer(logging.handlers.MemoryHandler):
+    # Writes out what RepeatFilter still holds on every flush, including the one on close
+    def __init__(self, capacity, repeats, **kwargs):
+        super().__init__(capacity, **kwargs)
+        self.repeats = repeats
+        self.addFilter(repeats)
+
+    def flush(self):
+        with self.lock:
+            self.buffer.extend(self.repeats.pending())
+            super().flush()
+
+def flush_periodically(handler, interval=LOG_FLUSH_INTERVAL):
+    while True:
+        time.sleep(interval)
+        handler.flush()
+
+def setup_logger(path=LOG_FILE):
+    logger = logging.getLogger("todo")
+    if logger.handlers:
+        return logger
+    file_handler = logging.handlers.RotatingFileHandler(
+        path, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUPS, encoding="utf-8", delay=True)
+    file_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s [%(threadName)s] %(message)s"))
+    # Only CRITICAL is written straight away, everything else waits for the buffer or the flusher
+    buffer = RepeatBuffer(LOG_BUFFER_RECORDS, RepeatFilter(), flushLevel=logging.CRITICAL, target=file_handler)
+    logger.addHandler(buffer)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    threading.Thread(target=flush_periodically, args=(buffer,), name="log-flush", daemon=True).start()
+    return logger
+
 def strikethrough(text):
     return ''.join(c + '\u0336' for c in text)
 
+def char_width(char):
+    # Terminal cells: combining marks such as the strikethrough take none, wide CJK and emoji take two
+    if unicodedata.combining(char) or unicodedata.category(char) in ('Mn', 'Me', 'Cf'):
+        return 0
+    if unicodedata.east_asian_width(char) in ('W', 'F'):
+        return 2
+    return 1
+
+def display_width(text):
+    if text.isascii():
+        return len(text)
+    return sum(char_width(char) for char in text)
+
+def fit(text, width):
+    # Longest prefix of text that fits in width cells, combining marks included
+    if text.isascii():
+        return text[:max(width, 0)]
+    used = 0
+    for i, char in enumerate(text):
+        used += char_width(char)
+        if used > width:
+            return text[:i]
+    return text
+
+def truncate(text, width):
+    if display_width(text) <= width:
+        return text
+    return fit(text, width - 1) + '…' if width > 0 else ''
+
+def wrap_lines(text, width):
+    # Breaks at the last space that fits, or inside a word wider than the line
+    if width <= 0:
+        return ['']
+    lines = []
+    while display_width(text) > width:
+        head = fit(text, width)
+        if not head:
+            break  # Not even one character fits, the rest is cut when drawn
+        if text[len(head)] == ' ':
+            cut = len(head)
+        else:
+            cut = head.rfind(' ')
+        if cut > 0:
+            lines.append(head[:cut])
+            text = text[cut:].lstrip(' ')
+        else:
+            lines.append(head)
+            text = text[len(head):]
+        if not text:
+            return lines
+    lines.append(text)
+    return lines
+
+def line_count(text, width):
+    if text.isascii() and len(text) <= width:
+        return 1
+    return len(wrap_lines(text, width))
+
+def find_keys(keys, sequence, start=0):
+    # Index of sequence in keys, or -1; every escape sequence starts with ESC
+    i = start
+    while True:
+        try:
+            i = keys.index(sequence[0], i)
+        except ValueError:
+            return -1
+        if tuple(keys[i:i + len(sequence)]) == sequence:
+            return i
+        i += 1
+
+def paste_open(keys):
+    # Whether the last paste in keys has not ended yet
+    start = find_keys(keys, PASTE_START)
+    while start != -1:
+        end = find_keys(keys, PASTE_END, start)
+        if end == -1:
+            return True
+        start = find_keys(keys, PASTE_START, end)
+    return False
+
+def read_keys(window, first):
+    # first and every key already waiting behind it; the caller sets the window's timeout back
+    keys = [first]
+    window.timeout(0)
+    while True:
+        key = window.getch()
+        if key == -1:
+            if not paste_open(keys):
+                break
+            # The terminal sends a long paste in pieces
+            window.timeout(PASTE_WAIT_MS)
+            key = window.getch()
+            window.timeout(0)
+            if key == -1:
+                break
+        keys.append(key)
+    return keys
+
+def split_keys(keys):
+    # -> [(kind, value)]: "text" for a run of typed characters, "paste" for pasted text, "key" for anything else
+    events = []
+    text = []
+    i = 0
+    while i < len(keys):
+        key = keys[i]
+        if key == PASTE_START[0] and tuple(keys[i:i + len(PASTE_START)]) == PASTE_START:
+            start = i + len(PASTE_START)
+            end = find_keys(keys, PASTE_END, start)
+            if end == -1:
+                end = len(keys)
+            if text:
+                events.append(("text", bytes(text).decode('utf-8', 'replace')))
+                text = []
+            pasted = [key for key in keys[start:end] if key < 256]
+            events.append(("paste", bytes(pasted).decode('utf-8', 'replace')))
+            i = end + len(PASTE_END)
+            continue
+        if 32 <= key < 256 and key != 127:
+            text.append(key)
+        else:
+            if text:
+                events.append(("text", bytes(text).decode('utf-8', 'replace')))
+                text = []
+            events.append(("key", key))
+        i += 1
+    if text:
+        events.append(("text", bytes(text).decode('utf-8', 'replace')))
+    return events
+
 def generate_code(length=4):
     return ''.join(random.choices(string.ascii_letters + string.digits, k=length))
 
+def new_item_id(last_id):
+    # Creation time in ms with random low bits, so clients adding rows between syncs do not pick
+    # the same id; never below last_id + 1, so the list stays in creation order on a lagging clock
+    stamp = max(int(time.time() * 1000), (last_id >> ID_RANDOM_BITS) + 1)
+    return stamp << ID_RANDOM_BITS | random.getrandbits(ID_RANDOM_BITS)
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def open_database(db_file, factory=sqlite3.Connection):
+    conn = sqlite3.connect(db_file, factory=factory, cached_statements=DB_CACHED_STATEMENTS)
+    for name, value in DB_PRAGMAS.items():
+        conn.execute(f"PRAGMA {name}={value}")
+    for statement in SYNC_SCHEMA + JOURNAL_SCHEMA:
+        conn.execute(statement)
+    return conn
+
+def create_search_index(cursor):
+    if cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'search'").fetchone():
+        return
+    cursor.execute(f"CREATE VIRTUAL TABLE search USING fts5(content, tokenize='{SEARCH_TOKENIZER}', prefix='2 3')")
+    # Triggers keep the index current for every writer, delta sync and the server included
+    for table, offset in SEARCH_TABLES.items():
+        # INSERT OR REPLACE does not fire delete triggers, so drop any old entry first
+        cursor.execute(f'''CREATE TRIGGER {table}_search_insert AFTER INSERT ON {table} BEGIN
+                               DELETE FROM search WHERE rowid = new.id * 2 + {offset};
+                               INSERT INTO search (rowid, content) VALUES (new.id * 2 + {offset}, new.content);
+                           END''')
+        cursor.execute(f'''CREATE TRIGGER {table}_search_update AFTER UPDATE OF content ON {table} BEGIN
+                               UPDATE search SET content = new.content WHERE rowid = old.id * 2 + {offset};
+                           END''')
+        cursor.execute(f'''CREATE TRIGGER {table}_search_delete AFTER DELETE ON {table} BEGIN
+                               DELETE FROM search WHERE rowid = old.id * 2 + {offset};
+                           END''')
+        cursor.execute(f'INSERT INTO search (rowid, content) SELECT id * 2 + {offset}, content FROM {table}')
+
+def search_expression(query):
+    # Every word must match as a prefix; quoting keeps FTS5 syntax in the query literal
+    return ' '.join('"' + term.replace('"', '""') + '"*' for term in query.split())
+
+def apply_ops(cursor, ops):
+    for name, rows in ops:
+        for statement in SYNC_OPS[name]:
+            cursor.executemany(statement, rows)
+
+def write_save(cursor, journal, ops, changelog, log_seq):
+    # Undo steps and journal_log entries first, their commands come before these edits
+    for statement, params in journal:
+        cursor.execute(statement, params)
+    apply_ops(cursor, ops)
+    if changelog:
+        cursor.executemany('INSERT INTO changelog (op, args) VALUES (?, ?)',
+                           [(name, json.dumps(args)) for name, rows in ops for args in rows])
+    # What journal_log held at the save is in the tables now
+    cursor.execute('DELETE FROM journal_log WHERE seq <= ?', (log_seq,))
+
+# Item flag bits; DONE and PRIORITY map to the highlighted/priority columns
+DONE = 1
+PRIORITY = 2
+BOLD = 4
+ITALIC = 8
+
+REF_PATTERN = re.compile(r"(\d+)([a-z]?)")  # 3 is a todo, 3b its second subtodo
+SUBTODO_PATTERN = re.compile(r"(\d+) (.+)")  # 3 text adds a subtodo to todo 3
+
+def parse_ref(text):
+    match = REF_PATTERN.fullmatch(text.strip())
+    if match is None:
+        raise ValueError(f"not an item: {text!r}")
+    number, letter = match.groups()
+    return (int(number) - 1, ord(letter) - 97 if letter else None)
+
+def parse_refs(text):
+    # 1,3,5 or 2-6 or 3b, mixed freely
+    refs = []
+    for part in text.split(','):
+        if '-' in part:
+            start, end = map(int, part.split('-'))
+            refs.extend((idx, None) for idx in range(start - 1, end))
+        else:
+            refs.append(parse_ref(part))
+    return refs
+
+def parse_word(text):
+    return text.strip().lower()
+
+# COMMANDS key -> (ToDoApp method, argument parser or None, extra arguments)
+COMMAND_HANDLERS = {
+    ":d ": ("toggle_refs", parse_refs, (DONE,)),
+    ":p ": ("toggle_refs", parse_refs, (PRIORITY,)),
+    ":x ": ("delete_refs", parse_refs, ()),
+    ":q ": ("quit", None, ()),
+    ":theme ": ("apply_theme", parse_word, ()),
+    ":b ": ("toggle_refs", parse_refs, (BOLD,)),
+    ":i ": ("toggle_refs", parse_refs, (ITALIC,)),
+    ":s ": ("save_to_http", None, ()),
+    ":check ": ("check_db_on_http", None, ()),
+    ":e ": ("toggle_expanded", parse_refs, ()),
+    ":u ": ("undo", None, ()),
+    ":wrap ": ("set_wrap", parse_word, ()),
+    ":r ": ("redo", None, ()),
+    "/": ("search", str.strip, ()),
+    "?": ("pin_filter", None, ()),
+}
+
+class CommandTrie:
+    # Prefix tree over command names; each node lists the commands below it in insertion order
+    def __init__(self, names):
+        self.root = {None: []}
+        for name in names:
+            node = self.root
+            node[None].append(name)
+            for char in name:
+                node = node.setdefault(char, {None: []})
+                node[None].append(name)
+            node[""] = name  # A command ends here
+
+    def complete(self, prefix):
+        node = self.root
+        for char in prefix:
+            node = node.get(char)
+            if node is None:
+                return []
+        return node[None]
+
+    def match(self, text):
+        # Longest command that text starts with
+        node, found = self.root, None
+        for char in text:
+            node = node.get(char)
+            if node is None:
+                break
+            found = node.get("", found)
+        return found
+
+COMMAND_TRIE = CommandTrie(COMMANDS)
+
+def parse_input(input_str):
+    # -> (ToDoApp method, arguments), or None when there is nothing to do
+    if not input_str.strip():
+        return None
+    # Commands are stored with their trailing space, so a bare ":q" still matches
+    name = COMMAND_TRIE.match(input_str + " ")
+    if name is not None:
+        method, parser, extra = COMMAND_HANDLERS[name]
+        try:
+            args = (parser(input_str[len(name):]),) if parser else ()
+        except ValueError:
+            return None  # Malformed arguments are ignored
+        return method, args + extra
+    if REF_PATTERN.fullmatch(input_str):
+        return "toggle_ref", (parse_ref(input_str), DONE)
+    match = SUBTODO_PATTERN.fullmatch(input_str)
+    if match:
+        return "add_subitem_at", (int(match.group(1)) - 1, match.group(2).strip())
+    return "add_item", (input_str,)
+
+class Item:
+    __slots__ = ('id', 'content', 'flags')
+
+    def __init__(self, item_id, content, flags=0):
+        self.id = item_id
+        self.content = content
+        self.flags = flags
+
+    def row_flags(self):
+        return (int(self.flags & DONE != 0), int(self.flags & PRIORITY != 0))
+
+class ChangeTracker:
+    # Rows touched since the last save, so save_todos only writes what changed
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.inserted_todos = {}  # todo_id -> Item
+        self.updated_todos = {}  # todo_id -> Item
+        self.deleted_todos = set()
+        self.inserted_subtodos = {}  # subtodo_id -> (parent_id, Item)
+        self.updated_subtodos = {}  # subtodo_id -> Item
+        self.deleted_subtodos = set()
+
+    def has_changes(self):
+        return bool(self.inserted_todos or self.updated_todos or self.deleted_todos or
+                    self.inserted_subtodos or self.updated_subtodos or self.deleted_subtodos)
+
+    def insert_todo(self, item):
+        self.inserted_todos[item.id] = item
+
+    def update_todo(self, item):
+        if item.id not in self.inserted_todos and item.id not in self.deleted_todos:
+            self.updated_todos[item.id] = item
+
+    def delete_todo(self, todo_id, subitems):
+        self.updated_todos.pop(todo_id, None)
+        if todo_id in self.inserted_todos:
+            del self.inserted_todos[todo_id]
+        else:
+            self.deleted_todos.add(todo_id)
+        # Pending writes for its children are superseded by the parent delete
+        for item in subitems:
+            self.inserted_subtodos.pop(item.id, None)
+            self.updated_subtodos.pop(item.id, None)
+
+    def insert_subtodo(self, parent_id, item):
+        self.inserted_subtodos[item.id] = (parent_id, item)
+
+    def update_subtodo(self, item):
+        if item.id not in self.inserted_subtodos and item.id not in self.deleted_subtodos:
+            self.updated_subtodos[item.id] = item
+
+    def delete_subtodo(self, subtodo_id):
+        self.updated_subtodos.pop(subtodo_id, None)
+        if subtodo_id in self.inserted_subtodos:
+            del self.inserted_subtodos[subtodo_id]
+        else:
+            self.deleted_subtodos.add(subtodo_id)
+
+class Journal:
+    # Operations the running command made, each paired with the one that reverts it. The undo history
+    # is kept here as well, so undo and redo never wait on the database; the journal and journal_log
+    # statements that mirror it are written by the save worker
+    def __init__(self):
+        self.pending = None
+        self.unsaved = False  # journal_log has entries no save has covered yet
+        self.steps = []  # [step, undo, redo, done] as in the journal table, by step
+        self.last_step = 0
+        self.log_seq = 0  # Last journal_log seq handed out
+
+    def load(self, cursor):
+        self.steps = [list(row) for row in cursor.execute('SELECT step, undo, redo, done FROM journal ORDER BY step')]
+        self.last_step = self.steps[-1][0] if self.steps else 0
+        self.log_seq = cursor.execute('SELECT MAX(seq) FROM journal_log').fetchone()[0] or 0
+
+    def log(self, ops):
+        self.log_seq += 1
+        self.unsaved = True
+        return ('INSERT INTO journal_log (seq, ops) VALUES (?, ?)', (self.log_seq, ops))
+
+    def add_step(self, undo, redo):
+        # -> statements that store the step; a new command ends the redo history
+        self.last_step += 1
+        step = self.last_step
+        self.steps = [entry for entry in self.steps if entry[3] and entry[0] > step - JOURNAL_STEPS]
+        self.steps.append([step, undo, redo, 1])
+        return [('DELETE FROM journal WHERE done = 0', ()),
+                ('INSERT INTO journal (step, undo, redo, done) VALUES (?, ?, ?, 1)', (step, undo, redo)),
+                ('DELETE FROM journal WHERE step <= ?', (step - JOURNAL_STEPS,)),
+                self.log(redo)]
+
+    def replay(self, done):
+        # -> (ops, statements) for the step undo (done 0) or redo (done 1) goes to next, or None
+        if done:
+            entry = next((entry for entry in self.steps if not entry[3]), None)
+        else:
+            entry = next((entry for entry in reversed(self.steps) if entry[3]), None)
+        if entry is None:
+            return None
+        entry[3] = done
+        ops = entry[2] if done else entry[1]
+        return ops, [('UPDATE journal SET done = ? WHERE step = ?', (done, entry[0])), self.log(ops)]
+
+    def begin(self):
+        self.pending = []
+
+    def recording(self):
+        return self.pending is not None
+
+    def record(self, undo, redo):
+        if self.pending is not None:
+            self.pending.append((undo, redo))
+
+    def end(self):
+        pending, self.pending = self.pending, None
+        return pending
+
+class RowIndex:
+    # Fenwick tree over the screen rows each todo takes (itself plus its subtodos)
+    def __init__(self):
+        self.tree = [0]
+        self.dirty = True
+
+    def __len__(self):
+        return len(self.tree) - 1
+
+    def rebuild(self, weights):
+        tree = [0] + list(weights)
+        for i in range(1, len(tree)):
+            parent = i + (i & -i)
+            if parent < len(tree):
+                tree[parent] += tree[i]
+        self.tree = tree
+        self.dirty = False
+
+    def weights(self):
+        # Undoes rebuild: every node gives its sum back before its parent is read
+        weights = self.tree[:]
+        for i in range(len(weights) - 1, 0, -1):
+            parent = i + (i & -i)
+            if parent < len(weights):
+                weights[parent] -= weights[i]
+        return weights[1:]
+
+    def append(self, weight):
+        if not self.dirty:
+            # Node i covers the weights from i - lowbit(i) + 1 to i; its children already hold all but the last
+            i = len(self.tree)
+            j = i - 1
+            while j > i - (i & -i):
+                weight += self.tree[j]
+                j -= j & -j
+            self.tree.append(weight)
+
+    def add(self, idx, delta):
+        if not self.dirty:
+            i = idx + 1
+            while i < len(self.tree):
+                self.tree[i] += delta
+                i += i & -i
+
+    def prefix(self, count):
+        # Rows taken by the first count todos
+        total = 0
+        while count > 0:
+            total += self.tree[count]
+            count -= count & -count
+        return total
+
+    def total(self):
+        return self.prefix(len(self))
+
+    def find(self, row):
+        # Index of the todo drawn at row, and the row's offset inside it
+        idx = 0
+        step = 1 << len(self).bit_length()
+        while step:
+            if idx + step <= len(self) and self.tree[idx + step] <= row:
+                idx += step
+                row -= self.tree[idx]
+            step >>= 1
+        return idx, row
+
+class RenderCache:
+    # Prepared (display lines, attr) per item; the dict is kept in use order, least recently used first
+    def __init__(self, size=RENDER_CACHE_SIZE):
+        self.size = size
+        self.entries = {}
+
+    def clear(self):
+        self.entries = {}
+
+    def get(self, key, build):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            entry = build()
+        self.entries[key] = entry
+        if len(self.entries) > self.size:
+            del self.entries[next(iter(self.entries))]
+        return entry
+
+class FuzzyFilter:
+    # Subsequence filter; each typed character only rescans the rows that matched before it
+    def __init__(self):
+        self.stack = []  # [(pattern, [(key, lowered text, end of match)])], one entry per character
+
+    def reset(self):
+        self.stack = []
+
+    def pattern(self):
+        return self.stack[-1][0] if self.stack else ""
+
+    def update(self, pattern, rows):
+        pattern = pattern.lower().replace(" ", "")
+        # Backspace pops back to a previous result instead of scanning again
+        while self.stack and not pattern.startswith(self.stack[-1][0]):
+            self.stack.pop()
+        if not pattern:
+            return None
+        if self.stack:
+            prefix, candidates = self.stack[-1]
+        else:
+            prefix, candidates = "", ((key, text.lower(), 0) for key, text in rows())
+        for char in pattern[len(prefix):]:
+            survivors = []
+            for key, text, end in candidates:
+                # The leftmost match of the prefix leaves the most room for the next character
+                pos = text.find(char, end)
+                if pos >= 0:
+                    survivors.append((key, text, pos + 1))
+            prefix += char
+            self.stack.append((prefix, survivors))
+            candidates = survivors
+        return candidates
+
+class CloudClient:
+    # One pooled keep-alive session shared by every request to the upload server
+    def __init__(self, base_url=DB_HOST, pool_size=HTTP_POOL_SIZE, timeout=HTTP_TIMEOUT, gzip_uploads=HTTP_GZIP_UPLOADS):
+        self.base_url = base_url
+        self.timeout = timeout
+        self.gzip_uploads = gzip_uploads
+        self.session = requests.Session()
+        self.adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', self.adapter)
+        self.session.mount('https://', self.adapter)
+        self.requests = 0
+        self.new_connections = 0
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+    def head(self, path, **kwargs):
+        return self.request('HEAD', path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request('POST', path, **kwargs)
+
+    def upload(self, path, filename, data):
+        prepared = self.session.prepare_request(requests.Request(
+            'POST', f"{self.base_url}{path}", files={'file': (filename, data)}))
+        if self.gzip_uploads:
+            prepared.body = gzip.compress(prepared.body)
+            prepared.headers['Content-Encoding'] = 'gzip'
+            prepared.headers['Content-Length'] = str(len(prepared.body))
+        return self.counted(lambda: self.session.send(prepared, timeout=self.timeout))
+
+    def request(self, method, path, **kwargs):
+        url = f"{self.base_url}{path}"
+        kwargs.setdefault('timeout', self.timeout)
+        return self.counted(lambda: self.session.request(method, url, **kwargs))
+
+    def counted(self, send):
+        # urllib3 counts the sockets each pool opens, anything else was a reused keep-alive connection
+        opened = self.opened_connections()
+        try:
+            return send()
+        finally:
+            self.requests += 1
+            self.new_connections += max(self.opened_connections() - opened, 0)
+
+    def opened_connections(self):
+        pools = self.adapter.poolmanager.pools
+        return sum(pools[key].num_connections for key in pools.keys())
+
+    def stats(self):
+        return f"{self.requests} requests, {self.new_connections} connections opened, {self.requests - self.new_connections} reused"
+
+class SnapshotCache:
+    # Server copies by database code, with the ETag and Last-Modified the server sent for them
+    def __init__(self, folder=CACHE_FOLDER):
+        self.folder = folder
+
+    def paths(self, code):
+        base = os.path.join(self.folder, code)
+        return base + '.db', base + '.json'
+
+    def validators(self, code):
+        # Headers for a conditional GET, only while the cached copy is the one they describe
+        db_path, meta_path = self.paths(code)
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+            if file_hash(db_path) != meta["sha256"]:
+                return {}
+        except (OSError, ValueError, KeyError):
+            return {}
+        headers = {}
+        if meta.get("etag"):
+            headers['If-None-Match'] = meta["etag"]
+        if meta.get("last_modified"):
+            headers['If-Modified-Since'] = meta["last_modified"]
+        return headers
+
+    def store(self, code, data, headers):
+        os.makedirs(self.folder, exist_ok=True)
+        db_path, meta_path = self.paths(code)
+        meta = {"sha256": hashlib.sha256(data).hexdigest(), "etag": headers.get('ETag'), "last_modified": headers.get('Last-Modified')}
+        # Each file is renamed into place; a crash in between leaves a hash mismatch, not a bad copy
+        for path, content, mode in ((db_path, data, 'wb'), (meta_path, json.dumps(meta), 'w')):
+            with open(path + '.tmp', mode) as f:
+                f.write(content)
+            os.replace(path + '.tmp', path)
+
+    def restore(self, code, target):
+        shutil.copyfile(self.paths(code)[0], target)
+
+class RemoteListing:
+    # Database names on the server, paged in while the picker is open and cached on disk for LISTING_TTL
+    def __init__(self, host, path=LISTING_CACHE, ttl=LISTING_TTL):
+        self.host = host
+        self.path = path
+        self.ttl = ttl
+        self.files = []  # What the picker shows
+        self.fetched = []  # Pages of the refresh in progress
+        self.cached = False
+        self.fresh = False
+        self.loading = False
+        self.wanted = True  # Cleared once a file is picked, stops the paging
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                cache = json.load(f)
+            if cache["host"] != self.host:
+                return
+            self.files = cache["files"]
+        except (OSError, ValueError, KeyError):
+            return
+        self.cached = True
+        self.fresh = time.time() - cache["time"] < self.ttl
+
+    def add_page(self, files, done):
+        self.fetched.extend(files)
+        if done:
+            self.files = self.fetched
+            self.loading = False
+            self.fresh = True
+            self.save()
+        elif not self.cached:
+            self.files = self.fetched  # Nothing better to show while the rest comes in
+
+    def fail(self):
+        self.loading = False
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(self.path + '.tmp', 'w') as f:
+            json.dump({"host": self.host, "time": time.time(), "files": self.files}, f)
+        os.replace(self.path + '.tmp', self.path)
+
+class SyncWorker:
+    # Runs HTTP requests off the UI thread; callbacks are handed back through poll()
+    def __init__(self, on_status, log):
+        self.on_status = on_status
+        self.log = log
+        self.jobs = queue.Queue()
+        self.results = queue.Queue()
+        self.thread = threading.Thread(target=self.work, daemon=True)
+        self.thread.start()
+
+    def submit(self, label, request, on_done, on_error):
+        self.jobs.put((label, request, on_done, on_error))
+
+    def call(self, label, request):
+        # Same timeouts and retries, but blocking; for startup before the UI is up
+        return self.attempt(label, request, self.on_status)
+
+    def attempt(self, label, request, report):
+        for attempt in range(HTTP_RETRIES + 1):
+            report(f"{label}..." if attempt == 0 else f"{label} (retry {attempt}/{HTTP_RETRIES})")
+            try:
+                response = request()
+                if response.status_code < 500 or attempt == HTTP_RETRIES:
+                    return response
+            except requests.RequestException:
+                if attempt == HTTP_RETRIES:
+                    raise
+            time.sleep(HTTP_BACKOFF * 2 ** attempt)
+
+    def work(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                return
+            label, request, on_done, on_error = job
+            try:
+                response = self.attempt(label, request, lambda status: self.results.put((label, self.on_status, (status,), None)))
+                self.results.put((label, on_done, (response,), on_error))
+            except Exception as e:
+                self.results.put((label, on_error, (e,), None))
+
+    def poll(self):
+        # Runs finished callbacks on the calling (UI) thread; one that raises, say on a body that
+        # is not JSON, ends its request as failed instead of the loop
+        while True:
+            try:
+                label, callback, args, on_error = self.results.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                callback(*args)
+            except Exception as e:
+                try:
+                    if on_error is None:
+                        raise
+                    on_error(e)
+                except Exception as e:
+                    self.log.error(f"{label} failed: {e}")
+                    self.on_status(f"{label} failed")
+
+    def stop(self, timeout):
+        self.jobs.put(None)
+        self.thread.join(timeout)
+        self.poll()
+
+class SaveWorker:
+    # Writes saves on its own thread and connection so the UI does not wait on the disk;
+    # batches that fail are kept and written again, oldest first, with the next one
+    def __init__(self, connect, on_saved, on_error):
+        self.connect = connect
+        self.on_saved = on_saved
+        self.on_error = on_error
+        self.jobs = queue.Queue()
+        self.results = queue.Queue()
+        self.unwritten = []  # Only touched by the worker thread
+        self.queued = 0  # Batches the UI has not heard are written
+        self.thread = threading.Thread(target=self.work, name="autosave", daemon=True)
+        self.thread.start()
+
+    def submit(self, batch):
+        self.queued += 1
+        self.jobs.put(batch)
+
+    def work(self):
+        conn = None
+        while True:
+            batch = self.jobs.get()
+            try:
+                if batch is None:
+                    break
+                self.unwritten.append(batch)
+                if conn is None:
+                    conn = self.connect()
+                with conn:  # Every batch in one transaction, so a retry never applies one twice
+                    cursor = conn.cursor()
+                    for batch in self.unwritten:
+                        write_save(cursor, *batch)
+                self.results.put((self.on_saved, (len(self.unwritten),)))
+                self.unwritten = []
+            except Exception as e:
+                self.results.put((self.on_error, (e,)))
+            finally:
+                self.jobs.task_done()
+        if conn is not None:
+            conn.close()
+
+    def poll(self):
+        # Runs finished callbacks on the calling (UI) thread
+        while True:
+            try:
+                callback, args = self.results.get_nowait()
+            except queue.Empty:
+                return
+            callback(*args)
+
+    def wait(self):
+        self.jobs.join()
+        self.poll()
+
+    def stop(self):
+        self.jobs.put(None)
+        self.thread.join()
+        self.poll()
+
 class ToDoApp:
     def __init__(self, stdscr):
         self.stdscr = stdscr
+        self.log = setup_logger()
         self.todos = []
-        self.subtodos = {}
-        self.highlighted = set()
-        self.priorities = set()
-        self.bold_notes = set()
-        self.italic_notes = set()
+        self.subtodos = {}  # parent_id -> [Item], only for parents read so far
+        self.subtodo_counts = {}  # parent_id -> number of subtodos, for every parent
+        self.expanded = set()  # Ids of the todos whose subtodos are shown
+        self.todo_cursor = None  # Open while load_todos is still streaming rows in
+        self.changes = ChangeTracker()
+        self.journal = Journal()
+        self.conn = None
+        self.synced = False  # Whether the server holds a base copy to apply deltas to
+        self.sync_seq = None  # Last server change applied locally
+        self.next_subtodo_id = 1
         self.current_theme = "dark"
         self.db_code = None
         self.db_file = None
         self.last_saved = "Not yet saved"
         self.http_status = "Disconnected"
+        self.cloud = CloudClient()
+        self.snapshots = SnapshotCache()
+        self.sync_worker = SyncWorker(self.set_http_status, self.log)
+        self.save_worker = SaveWorker(lambda: open_database(self.db_file), self.finish_save, self.save_failed)
+        self.save_due = None  # When the pending edits are written, None while there are none
+        self.unsaved_commands = 0
+        self.sync_in_flight = False
+        self.upload_in_flight = False  # Log changes made while the upload snapshot is in transit
+        self.sync_on_start = False  # The local copy was kept for its pending edits, they go out once loaded
+        self.search_results = None  # (query, [(label, item)]) shown instead of the list
+        self.fuzzy = FuzzyFilter()
+        self.filter_matches = None  # Rows matching the '?' filter, shown instead of the list
+        self.filter_live = False  # Whether the prompt is still editing the filter
+        self.last_frame = None  # Segments currently on screen, one entry per row
+        self.render_cache = RenderCache()
+        self.wrap = False  # Long items wrap onto more rows instead of being cut
+        self.layout_width = stdscr.getmaxyx()[1]  # Width the row weights were measured at
+        self.todo_rows = RowIndex()
+        self.scroll_top = 0  # First list row shown on screen
+        self.list_height = 0
+        self.frame_size = None
         self.init_colors()
         self.initialize_database()
         self.load_todos()
+        if self.sync_on_start and self.synced:
+            self.save_to_http()  # A copy that never synced is not pushed over whatever the server holds
         self.run()
 
     def init_colors(self):
@@ -105,12 +1100,19 @@ class ToDoApp:
             self.prompt_symbol_color = curses.color_pair(4)
             self.background_color_pair = curses.color_pair(2)  # Use the same as text background
             self.current_theme = theme_name
+            self.render_cache.clear()
+            self.invalidate()
 
     def initialize_database(self):
         self.db_code = self.prompt_for_code()
         if self.db_code:
             self.db_file = f"{self.db_code}.db"
-            if not self.download_db_if_exists():
+            if self.local_pending():
+                # Downloading would replace edits this copy has not saved or synced; load_todos replays them
+                self.sync_on_start = True
+                self.set_http_status("Local changes kept")
+                self.log.warning("Local database has unsaved or unsynced changes, not downloading.")
+            elif not self.download_db_if_exists() and not os.path.exists(self.db_file):
                 self.db_code = generate_code()
                 with open("db_code.txt", "w") as f:
                     f.write(self.db_code)
@@ -121,46 +1123,112 @@ class ToDoApp:
         return self.file_explorer()
 
     def file_explorer(self):
-        files = self.list_db_files()
-        if not files:
-            return None
-        
+        # Shows the cached listing straight away; a stale or missing one is refreshed page by page meanwhile
+        listing = RemoteListing(self.cloud.base_url)
+        listing.load()
+        if not listing.fresh:
+            listing.loading = True
+            self.list_db_files(listing)
+        fuzzy = FuzzyFilter()  # Typing narrows the list
+        pattern = ""
         selected_index = 0
-        while True:
-            self.stdscr.clear()
-            self.stdscr.addstr(0, 0, "Select a database file:")
-            for idx, file in enumerate(files):
-                if idx == selected_index:
-                    self.stdscr.addstr(idx + 1, 0, file, curses.A_REVERSE)
-                else:
-                    self.stdscr.addstr(idx + 1, 0, file)
-            self.stdscr.refresh()
-
-            key = self.stdscr.getch()
-            if key == curses.KEY_UP and selected_index > 0:
-                selected_index -= 1
-            elif key == curses.KEY_DOWN and selected_index < len(files) - 1:
-                selected_index += 1
-            elif key == curses.KEY_ENTER or key == 10:
-                return files[selected_index].replace('.db', '')
-
-    def list_db_files(self):
+        top = 0
+        shown_files, shown_len = None, 0
+        self.stdscr.timeout(POLL_INTERVAL_MS)  # Keep picking up pages while idle
         try:
-            response = requests.get(f"{DB_HOST}{UPLOAD_ENDPOINT}")
-            if response.status_code == 200:
-                files = response.json()
-                return [file for file in files if file.endswith('.db')]
+            while True:
+                self.sync_worker.poll()
+                files = listing.files
+                if shown_files is not files or shown_len != len(files):
+                    fuzzy.reset()  # New pages arrived
+                    shown_files, shown_len = files, len(files)
+                if not files and not listing.loading:
+                    return None
+                matches = fuzzy.update(pattern, lambda: ((idx, file) for idx, file in enumerate(files)))
+                keys = range(len(files)) if matches is None else [key for key, _, _ in matches]
+                height, width = self.stdscr.getmaxyx()
+                list_height = max(height - 2, 1)
+                selected_index = max(0, min(selected_index, len(keys) - 1))
+                top = max(min(top, selected_index), selected_index - list_height + 1)
+                self.draw_explorer(height, width, [files[key] for key in keys[top:top + list_height]],
+                                   selected_index - top, f"Filter: {pattern} | {len(keys)} of {len(files)}"
+                                   + (" | Loading..." if listing.loading else ""))
+
+                key = self.stdscr.getch()
+                if key == curses.KEY_UP:
+                    selected_index -= 1
+                elif key == curses.KEY_DOWN:
+                    selected_index += 1
+                elif key == curses.KEY_PPAGE:
+                    selected_index -= list_height
+                elif key == curses.KEY_NPAGE:
+                    selected_index += list_height
+                elif key == curses.KEY_BACKSPACE or key == 127:
+                    pattern = pattern[:-1]
+                elif key == curses.KEY_ENTER or key == 10:
+                    if keys:
+                        return files[keys[selected_index]].replace('.db', '')
+                elif 32 <= key < 127:
+                    pattern += chr(key)
+                    selected_index = 0
+        finally:
+            listing.wanted = False
+
+    def draw_explorer(self, height, width, names, selected, status):
+        frame = [[] for _ in range(height)]
+        frame[0].append((0, "Select a database file:", self.text_color))
+        for y, name in enumerate(names[:height - 2]):
+            attr = self.text_color
+            if y == selected:
+                attr |= curses.A_REVERSE
+            frame[y + 1].append((0, name, attr))
+        frame[height - 1].append((0, status, self.linenumber_color))
+        self.render_frame([tuple(line) for line in frame], height, width)
+        self.stdscr.noutrefresh()
+        curses.doupdate()
+
+    def list_db_files(self, listing, after=None):
+        params = {"limit": LISTING_PAGE}
+        if after is not None:
+            params["after"] = after
+        self.sync_worker.submit("Listing", lambda: self.cloud.get(UPLOAD_ENDPOINT, params=params),
+            lambda response: self.finish_listing(listing, response), lambda error: self.listing_failed(listing, error))
+
+    def finish_listing(self, listing, response):
+        if response.status_code != 200:
+            listing.fail()
+            self.set_http_status(f"Listing failed ({response.status_code})")
+            self.log.error(f"Failed to list files on HTTP server: {response.status_code}")
+            return
+        self.set_http_status("Connected")
+        # Servers without paging send everything and no X-Next-After
+        after = response.headers.get('X-Next-After')
+        listing.add_page([file for file in response.json() if file.endswith('.db')], after is None)
+        if after is not None:
+            if listing.wanted:
+                self.list_db_files(listing, after)
             else:
-                self.log_error(f"Failed to list files on HTTP server: {response.status_code}")
-                return []
-        except Exception as e:
-            self.log_error(f"Error listing files on HTTP server: {e}")
-            return []
+                listing.fail()  # A file was picked, the partial listing is not cached
+
+    def listing_failed(self, listing, error):
+        listing.fail()
+        self.set_http_status("Listing failed")
+        self.log.error(f"Error listing files on HTTP server: {error}")
+
+    def get_connection(self):
+        if self.conn is None:
+            self.conn = open_database(self.db_file)
+        return self.conn
+
+    def close_connection(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
 
     def create_db_if_not_exists(self):
         try:
             if not os.path.exists(self.db_file):
-                conn = sqlite3.connect(self.db_file)
+                conn = self.get_connection()
                 cursor = conn.cursor()
                 cursor.execute('''CREATE TABLE IF NOT EXISTS todos (
                                     id INTEGER PRIMARY KEY,
@@ -174,409 +1242,1151 @@ class ToDoApp:
                                     highlighted INTEGER,
                                     priority INTEGER,
                                     FOREIGN KEY(parent_id) REFERENCES todos(id))''')
+                cursor.execute(SUBTODO_INDEX)
                 conn.commit()
-                conn.close()
-                self.log_error("Database created successfully.")
+                self.log.info("Database created successfully.")
             else:
-                self.log_error("Database already exists.")
+                self.log.info("Database already exists.")
         except Exception as e:
-            self.log_error(f"Error creating database: {e}")
+            self.log.error(f"Error creating database: {e}")
+
+    def local_pending(self):
+        # Whether the local copy has commands no save covered (journal_log) or edits the server has not seen
+        if not os.path.exists(self.db_file):
+            return False
+        try:
+            conn = self.get_connection()
+            return any(conn.execute(f'SELECT 1 FROM {table} LIMIT 1').fetchone() for table in ('journal_log', 'changelog'))
+        except sqlite3.Error as e:
+            self.log.error(f"Error reading local database: {e}")
+            return False
+        finally:
+            self.close_connection()  # The download may replace the file
 
     def download_db_if_exists(self):
         try:
-            response = requests.get(f"{DB_HOST}{UPLOAD_ENDPOINT}/{self.db_file}")
-            if response.status_code == 200:
-                with open(self.db_file, 'wb') as f:
-                    f.write(response.content)
-                self.log_error("Database downloaded successfully.")
+            # 304 when the cached copy is still the server's, then nothing is transferred
+            headers = self.snapshots.validators(self.db_code)
+            response = self.sync_worker.call("Downloading", lambda: self.cloud.get(f"{UPLOAD_ENDPOINT}/{self.db_file}", headers=headers))
+            if response.status_code in (200, 304):
+                self.set_http_status("Connected")
+                # A leftover WAL from an older local copy would be replayed over the download
+                for suffix in ('-wal', '-shm'):
+                    if os.path.exists(self.db_file + suffix):
+                        os.remove(self.db_file + suffix)
+                if response.status_code == 200:
+                    self.snapshots.store(self.db_code, response.content, response.headers)
+                    with open(self.db_file, 'wb') as f:
+                        f.write(response.content)
+                    self.log.info("Database downloaded successfully.")
+                else:
+                    self.snapshots.restore(self.db_code, self.db_file)
+                    self.log.info("Database unchanged on HTTP server, copied from the local cache.")
+                self.reset_sync_state(response.headers.get('X-Sync-Seq'))
                 return True
+            elif response.status_code == 404:
+                self.set_http_status("Database not found")
+                self.log.warning("Database not found on HTTP server.")
+                return False
             else:
-                self.log_error("Database not found on HTTP server.")
+                self.set_http_status(f"Download failed ({response.status_code})")
+                self.log.warning(f"Failed to download database: {response.status_code}")
                 return False
         except Exception as e:
-            self.log_error(f"Error downloading database: {e}")
+            self.set_http_status("Download failed")
+            self.log.error(f"Error downloading database: {e}")
             return False
 
     def load_todos(self):
         try:
             if not os.path.exists(self.db_file):
-                self.log_error("No local database file found.")
+                self.log.warning("No local database file found.")
                 return
-            conn = sqlite3.connect(self.db_file)
+            conn = self.get_connection()
             cursor = conn.cursor()
-            cursor.execute('SELECT * FROM todos')
-            rows = cursor.fetchall()
-            for row in rows:
-                self.todos.append((row[0], row[1]))  # Include ID with the content
-                if row[2]:
-                    self.highlighted.add(f"{row[0]}")
-                if row[3]:
-                    self.priorities.add(f"{row[0]}")
-            
-            cursor.execute('SELECT * FROM subtodos')
-            rows = cursor.fetchall()
+            self.load_sync_state(cursor)
+            cursor.execute(SUBTODO_INDEX)  # Databases created before the index existed
+            self.init_search_index()
+            cursor.execute('SELECT MAX(id) FROM subtodos')
+            max_id = cursor.fetchone()[0]
+            if max_id is not None:
+                self.next_subtodo_id = max(self.next_subtodo_id, max_id + 1)
+
+            # Only the first screen is read here, load_more streams in the rest.
+            # Subtodos are read per parent when first needed, only their counts come with the todos
+            self.subtodo_counts = {}
+            self.todo_rows.rebuild([])
+            self.todo_cursor = conn.execute('''SELECT id, content, highlighted, priority,
+                                                      (SELECT COUNT(*) FROM subtodos WHERE parent_id = todos.id)
+                                               FROM todos ORDER BY id''')
+            self.load_more(self.stdscr.getmaxyx()[0])
+            self.journal.load(cursor)
+            self.replay_journal_log(cursor)
+        except Exception as e:
+            self.log.error(f"Error loading todos: {e}")
+
+    def replay_journal_log(self, cursor):
+        # Commands applied but never saved, the app stopped in between
+        logged = cursor.execute('SELECT ops FROM journal_log ORDER BY seq').fetchall()
+        if not logged:
+            return
+        self.finish_loading()
+        for (ops,) in logged:
+            self.apply_journal(json.loads(ops))
+        self.journal.unsaved = True
+        self.save_todos()
+        self.log.warning(f"Replayed {len(logged)} unsaved commands from the journal.")
+
+    def load_more(self, count=LOAD_CHUNK):
+        if self.todo_cursor is None:
+            return
+        try:
+            rows = self.todo_cursor.fetchmany(count)
             for row in rows:
-                if row[1] not in self.subtodos:
-                    self.subtodos[row[1]] = []
-                self.subtodos[row[1]].append((row[0], row[2]))  # Include ID with the content
-                if row[3]:
-                    self.highlighted.add(f"{row[1]}_{len(self.subtodos[row[1]]) - 1}")
+                todo = Item(row[0], row[1], (DONE if row[2] else 0) | (PRIORITY if row[3] else 0))
+                self.todos.append(todo)
                 if row[4]:
-                    self.priorities.add(f"{row[1]}_{len(self.subtodos[row[1]]) - 1}")
-            
-            conn.close()
-            self.log_error("Todos and subtodos loaded successfully.")
+                    self.subtodo_counts[row[0]] = row[4]
+                self.todo_rows.append(self.row_weight(todo))
+            if len(rows) < count:
+                self.todo_cursor = None
+                self.log.info("Todos and subtodos loaded successfully.")
         except Exception as e:
-            self.log_error(f"Error loading todos: {e}")
+            self.todo_cursor = None
+            self.log.error(f"Error loading todos: {e}")
+
+    def finish_loading(self):
+        # Anything that works on positions or ids needs the whole list
+        while self.todo_cursor is not None:
+            self.load_more()
+
+    def subitems(self, parent_id):
+        if parent_id not in self.subtodos:
+            if self.subtodo_counts.get(parent_id, 0):
+                cursor = self.get_connection().execute(
+                    'SELECT id, content, highlighted, priority FROM subtodos WHERE parent_id = ? ORDER BY id', (parent_id,))
+                self.subtodos[parent_id] = [Item(row[0], row[1], (DONE if row[2] else 0) | (PRIORITY if row[3] else 0))
+                                            for row in cursor]
+            else:
+                self.subtodos[parent_id] = []
+        return self.subtodos[parent_id]
+
+    def init_search_index(self):
+        conn = self.get_connection()
+        try:
+            with conn:
+                create_search_index(conn.cursor())
+        except sqlite3.OperationalError as e:
+            # SQLite built without FTS5, the rest of the app still works
+            self.log.warning(f"Search index unavailable: {e}")
+
+    def search(self, query):
+        if not query.strip():
+            self.search_results = None
+            return
+        self.save_todos()  # The index only sees what is in the database
+        cursor = self.get_connection().cursor()
+        rows = cursor.execute('''SELECT search.rowid, subtodos.parent_id FROM search
+                                 LEFT JOIN subtodos ON search.rowid % 2 = 1 AND subtodos.id = search.rowid / 2
+                                 WHERE search MATCH ? ORDER BY search.rank LIMIT ?''',
+                              (search_expression(query), SEARCH_LIMIT)).fetchall()
+        results = []
+        for rowid, parent_id in rows:
+            item_id = rowid // 2
+            idx = self.todo_index(parent_id if rowid % 2 else item_id)
+            if idx is None:
+                continue
+            if not rowid % 2:
+                results.append((self.row_label(idx, None), self.todos[idx]))
+                continue
+            for j, subtodo in enumerate(self.subitems(parent_id)):
+                if subtodo.id == item_id:
+                    results.append((self.row_label(idx, j), subtodo))
+                    break
+        self.search_results = (query, results)
+
+    def filter_rows(self):
+        # Parents not read yet are matched from the database without loading their Items;
+        # both are in id order, so one pass over the cursor lines them up with self.todos
+        cursor = self.get_connection().execute('SELECT parent_id, content FROM subtodos ORDER BY parent_id, id')
+        row = next(cursor, None)
+        for idx, todo in enumerate(self.todos):
+            yield (idx, None), todo.content
+            while row is not None and row[0] < todo.id:
+                row = next(cursor, None)  # Left behind by a deleted parent
+            j = 0
+            while row is not None and row[0] == todo.id:
+                if todo.id not in self.subtodos:
+                    yield (idx, j), row[1]
+                j += 1
+                row = next(cursor, None)
+            for j, subtodo in enumerate(self.subtodos.get(todo.id, ())):
+                yield (idx, j), subtodo.content
+
+    def update_filter(self, input_str):
+        # Live while the prompt holds '?pattern'; an entered filter stays up until the next command
+        if input_str.startswith("?"):
+            self.finish_loading()
+            self.filter_matches = self.fuzzy.update(input_str[1:], self.filter_rows)
+        elif self.filter_live:
+            self.filter_matches = None
+        self.filter_live = input_str.startswith("?")
+
+    def row_label(self, idx, sub_idx):
+        return f"{idx + 1}." if sub_idx is None else f"{idx + 1}{chr(97 + sub_idx)}."
+
+    def has_row(self, idx, sub_idx):
+        if not 0 <= idx < len(self.todos):
+            return False
+        return sub_idx is None or 0 <= sub_idx < self.subtodo_counts.get(self.todos[idx].id, 0)
+
+    def row_item(self, idx, sub_idx):
+        todo = self.todos[idx]
+        return todo if sub_idx is None else self.subitems(todo.id)[sub_idx]
 
     def save_todos(self):
+        # Returns once everything is in the database; sync, search and quit read the tables next
+        self.flush_save()
+        self.save_worker.wait()
+
+    def flush_save(self):
+        # Hands the pending edits to the save worker without waiting for the disk
+        self.save_due = None
+        self.unsaved_commands = 0
         try:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            cursor.execute('DELETE FROM todos')
-            cursor.execute('DELETE FROM subtodos')
-            for i, (todo_id, todo) in enumerate(self.todos):
-                cursor.execute('INSERT INTO todos (id, content, highlighted, priority) VALUES (?, ?, ?, ?)',
-                               (todo_id, todo, int(f"{todo_id}" in self.highlighted), int(f"{todo_id}" in self.priorities)))
-                if todo_id in self.subtodos:
-                    for j, (subtodo_id, subtodo) in enumerate(self.subtodos[todo_id]):
-                        cursor.execute('INSERT INTO subtodos (id, parent_id, content, highlighted, priority) VALUES (?, ?, ?, ?, ?)',
-                                       (subtodo_id, todo_id, subtodo, int(f"{todo_id}_{j}" in self.highlighted), int(f"{todo_id}_{j}" in self.priorities)))
-            conn.commit()
-            conn.close()
-            self.last_saved = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            self.log_error("Todos and subtodos saved successfully.")
+            batch = self.take_save()
+            if batch is not None:
+                self.save_worker.submit(batch)
+            elif self.save_worker.queued:
+                self.save_worker.submit(([], [], False, 0))  # Nothing new, but a failed batch is retried
         except Exception as e:
-            self.log_error(f"Error saving todos: {e}")
+            self.log.error(f"Error saving todos: {e}")
+
+    def take_save(self):
+        # -> write_save arguments for everything pending, or None; the tracker starts over
+        if not self.changes.has_changes() and not self.journal.unsaved:
+            return None
+        ops = self.pending_ops(self.changes)
+        self.changes.clear()
+        self.journal.unsaved = False
+        return [], ops, self.synced or self.upload_in_flight, self.journal.log_seq
+
+    def schedule_save(self):
+        # Write-behind for the tables: edits pile up until AUTOSAVE_DELAY_MS or AUTOSAVE_COMMANDS, then go
+        # out together; commit_step has already queued each command's journal_log entry ahead of them
+        if not self.changes.has_changes() and not self.journal.unsaved:
+            return
+        self.unsaved_commands += 1
+        if self.save_due is None:
+            self.save_due = time.monotonic() + AUTOSAVE_DELAY_MS / 1000
+        if self.unsaved_commands >= AUTOSAVE_COMMANDS:
+            self.flush_save()
+
+    def autosave(self):
+        if self.save_due is not None and time.monotonic() >= self.save_due:
+            self.flush_save()
+
+    def finish_save(self, batches):
+        self.save_worker.queued -= batches
+        self.last_saved = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        self.log.info("Todos and subtodos saved successfully.")
+
+    def save_failed(self, error):
+        # The worker keeps the batch; journal_log still replays it if the app stops first
+        self.log.error(f"Error saving todos: {error}")
+
+    def unsaved(self):
+        return self.save_due is not None or self.save_worker.queued > 0
+
+    def idle_timeout(self, loading):
+        # getch wait: none while rows are loading, and no longer than the next autosave
+        if loading:
+            return 0
+        if self.save_due is None:
+            return POLL_INTERVAL_MS
+        return max(0, min(POLL_INTERVAL_MS, int((self.save_due - time.monotonic()) * 1000)))
+
+    def pending_ops(self, changes):
+        return [
+            ("delete_subtodo", [(subtodo_id,) for subtodo_id in changes.deleted_subtodos]),
+            ("delete_todo", [(todo_id,) for todo_id in changes.deleted_todos]),
+            ("insert_todo", [(item.id, item.content) + item.row_flags() for item in changes.inserted_todos.values()]),
+            ("update_todo", [item.row_flags() + (item.id,) for item in changes.updated_todos.values()]),
+            ("insert_subtodo", [(item.id, parent_id, item.content) + item.row_flags()
+                                for parent_id, item in changes.inserted_subtodos.values()]),
+            ("update_subtodo", [item.row_flags() + (item.id,) for item in changes.updated_subtodos.values()]),
+        ]
 
     def save_to_http(self):
+        if self.sync_in_flight:
+            self.set_http_status("Sync already running")
+            return
         try:
-            with open(self.db_file, 'rb') as db_file:
-                files = {'file': db_file}
-                response = requests.post(f"{DB_HOST}{UPLOAD_ENDPOINT}", files=files)
-                if response.status_code == 200:
-                    self.last_saved = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                    self.log_error("Database saved to HTTP server successfully.")
-                else:
-                    self.log_error(f"Failed to save database to HTTP server: {response.status_code}")
+            self.save_todos()
+            if self.synced:
+                self.sync_changes()
+            else:
+                self.upload_db()
         except Exception as e:
-            self.log_error(f"Error saving database to HTTP server: {e}")
+            self.sync_failed(e)
+
+    def sync_failed(self, error):
+        self.sync_in_flight = False
+        self.upload_in_flight = False
+        self.set_http_status("Sync failed")
+        self.log.error(f"Error saving database to HTTP server: {error}")
+
+    def upload_db(self):
+        conn = self.get_connection()
+        data = self.database_bytes(conn)
+        with conn:
+            conn.execute('DELETE FROM changelog')
+        self.sync_in_flight = True
+        self.upload_in_flight = True
+        self.sync_worker.submit("Uploading", lambda: self.cloud.upload(UPLOAD_ENDPOINT, self.db_file, data),
+            lambda response: self.finish_upload(response, data), self.sync_failed)
+
+    def database_bytes(self, conn):
+        # Fold the WAL back into the main file so the upload has every commit; a reader still on the
+        # WAL makes the checkpoint report busy, then a backup copy has them instead
+        busy, _, _ = conn.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchone()
+        if not busy:
+            with open(self.db_file, 'rb') as db_file:
+                return db_file.read()
+        self.log.warning("WAL checkpoint busy, uploading a backup copy.")
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, os.path.basename(self.db_file))
+            copy = sqlite3.connect(path)
+            conn.backup(copy)
+            copy.close()
+            with open(path, 'rb') as db_file:
+                return db_file.read()
+
+    def finish_upload(self, response, data):
+        self.sync_in_flight = False
+        self.upload_in_flight = False
+        if response.status_code == 200:
+            self.snapshots.store(self.db_code, data, response.headers)
+            seq = response.headers.get('X-Sync-Seq')
+            with self.get_connection() as conn:
+                self.store_sync_seq(conn.cursor(), int(seq) if seq is not None else None)
+            self.last_saved = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            self.set_http_status("Connected")
+            self.log.info(f"Database saved to HTTP server successfully. ({self.cloud.stats()})")
+        else:
+            self.set_http_status(f"Upload failed ({response.status_code})")
+            self.log.error(f"Failed to save database to HTTP server: {response.status_code}")
+
+    def sync_changes(self):
+        pending = self.get_connection().execute('SELECT seq, op, args FROM changelog ORDER BY seq').fetchall()
+        payload = {"since": self.sync_seq, "changes": [[op, json.loads(args)] for _, op, args in pending]}
+        self.sync_in_flight = True
+        self.sync_worker.submit("Syncing", lambda: self.cloud.post(f"{SYNC_ENDPOINT}/{self.db_file}", json=payload),
+            lambda response: self.finish_sync(pending, response), self.sync_failed)
+
+    def finish_sync(self, pending, response):
+        self.sync_in_flight = False
+        if response.status_code != 200:
+            # The server cannot apply deltas and needs a full copy
+            self.log.warning(f"Delta sync refused by HTTP server: {response.status_code}")
+            self.save_todos()
+            self.upload_db()
+            return
+        result = response.json()
+        if result["changes"]:
+            self.save_todos()  # Every local edit has to be in the changelog for the replay below
+        conn = self.get_connection()
+        with conn:
+            cursor = conn.cursor()
+            apply_ops(cursor, [(op, [args]) for op, args in result["changes"]])
+            if result["changes"]:
+                # The server applied our ops after the ones we missed; redo ours on top so both end up
+                # the same, along with anything edited since the request went out
+                local = cursor.execute('SELECT op, args FROM changelog ORDER BY seq').fetchall()
+                apply_ops(cursor, [(op, [json.loads(args)]) for op, args in local])
+            if pending:
+                cursor.execute('DELETE FROM changelog WHERE seq <= ?', (pending[-1][0],))
+            self.store_sync_seq(cursor, result["seq"])
+        if result["changes"]:
+            self.reload_todos()
+        self.last_saved = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        self.set_http_status("Connected")
+        self.log.info(f"Synced {len(pending)} local and {len(result['changes'])} remote changes. ({self.cloud.stats()})")
+
+    def load_sync_state(self, cursor):
+        row = cursor.execute("SELECT value FROM sync_state WHERE key = 'server_seq'").fetchone()
+        self.synced = row is not None
+        self.sync_seq = row[0] if row else None
+
+    def store_sync_seq(self, cursor, seq):
+        cursor.execute("INSERT OR REPLACE INTO sync_state (key, value) VALUES ('server_seq', ?)", (seq,))
+        self.synced = True
+        self.sync_seq = seq
+
+    def reset_sync_state(self, seq):
+        # The local file now matches the server copy, so nothing is pending; local_pending has made sure
+        # no edits of ours were in the file it replaced, whatever is logged here came with the download
+        conn = self.get_connection()
+        with conn:
+            cursor = conn.cursor()
+            cursor.execute('DELETE FROM changelog')
+            # Undo history from whoever uploaded the file does not apply here
+            cursor.execute('DELETE FROM journal')
+            cursor.execute('DELETE FROM journal_log')
+            self.store_sync_seq(cursor, int(seq) if seq is not None else None)
+
+    def reload_todos(self):
+        # Bold and italic are not stored in the database, carry them over by id
+        styles = {item.id: item.flags & (BOLD | ITALIC) for item in self.todos}
+        sub_styles = {item.id: item.flags & (BOLD | ITALIC) for items in self.subtodos.values() for item in items}
+        loaded = list(self.subtodos)
+        self.todos = []
+        self.subtodos = {}
+        self.search_results = None
+        self.filter_matches = None
+        self.fuzzy.reset()
+        self.load_todos()
+        self.finish_loading()
+        for item in self.todos:
+            item.flags |= styles.get(item.id, 0)
+        # Read the same parents again so their styles have somewhere to go
+        for parent_id in loaded:
+            for item in self.subitems(parent_id):
+                item.flags |= sub_styles.get(item.id, 0)
 
     def check_db_on_http(self):
-        try:
-            response = requests.head(f"{DB_HOST}{UPLOAD_ENDPOINT}/{self.db_file}")
-            if response.status_code == 200:
-                self.log_error("Database is present on HTTP server.")
-                return True
-            else:
-                self.log_error("Database is not present on HTTP server.")
-                return False
-        except Exception as e:
-            self.log_error(f"Error checking database on HTTP server: {e}")
-            return False
+        self.sync_worker.submit("Checking", lambda: self.cloud.head(f"{UPLOAD_ENDPOINT}/{self.db_file}"),
+            self.finish_check, self.check_failed)
 
-    def fill_background(self):
-        try:
-            height, width = self.stdscr.getmaxyx()
-            for y in range(height):
-                self.stdscr.addstr(y, 0, " " * width, self.background_color_pair)
-        except Exception as e:
-            self.log_error(f"Error filling background: {e}")
+    def finish_check(self, response):
+        if response.status_code == 200:
+            self.set_http_status("Database is present on HTTP server")
+            self.log.info(f"Database is present on HTTP server. ({self.cloud.stats()})")
+        else:
+            self.set_http_status("Database is not present on HTTP server")
+            self.log.info(f"Database is not present on HTTP server. ({self.cloud.stats()})")
+
+    def check_failed(self, error):
+        self.set_http_status("Check failed")
+        self.log.error(f"Error checking database on HTTP server: {error}")
+
+    def set_http_status(self, status):
+        self.http_status = status
 
     def draw(self, input_str="", suggestions=None, selected_suggestion_index=None):
         try:
-            self.stdscr.clear()
-            self.fill_background()
             height, width = self.stdscr.getmaxyx()
-
-            # Draw todos
-            row_idx = 0
-            for i in range(height - 5):  # To keep space for the prompt and status lines
-                if row_idx < len(self.todos):
-                    todo_id, todo = self.todos[row_idx]
-                    attr = self.text_color
-                    display_text = todo
-                    if f"{todo_id}" in self.priorities:
-                        attr |= curses.A_BOLD
-                    if f"{todo_id}" in self.bold_notes:
-                        attr |= curses.A_BOLD | self.bold_color
-                    if f"{todo_id}" in self.italic_notes:
-                        attr = self.italic_color
-                    if f"{todo_id}" in self.highlighted:
-                        display_text = strikethrough(todo)
-                        self.stdscr.addstr(row_idx, 0, "✔", self.strikethrough_icon_color)
-                    else:
-                        self.stdscr.addstr(row_idx, 0, f"{i + 1}.", self.linenumber_color)
-
-                    self.stdscr.addstr(row_idx, 4, display_text, attr)
-                    row_idx += 1
-
-                    # Draw subtodos if any
-                    if todo_id in self.subtodos:
-                        for j, (subtodo_id, subtodo) in enumerate(self.subtodos[todo_id]):
-                            attr = self.text_color
-                            display_text = subtodo
-                            subtask_key = f"{todo_id}_{j}"
-                            if subtask_key in self.priorities:
-                                attr |= curses.A_BOLD
-                            if subtask_key in self.bold_notes:
-                                attr |= curses.A_BOLD | self.bold_color
-                            if subtask_key in self.italic_notes:
-                                attr = self.italic_color
-                            if subtask_key in self.highlighted:
-                                display_text = strikethrough(subtodo)
-                                self.stdscr.addstr(row_idx, 4, "✔", self.strikethrough_icon_color)
-                            else:
-                                self.stdscr.addstr(row_idx, 4, chr(97 + j) + ".", self.linenumber_color)
-
-                            self.stdscr.addstr(row_idx, 8, display_text, attr)
-                            row_idx += 1
-                else:
-                    self.stdscr.addstr(row_idx, 0, "♠", self.linenumber_color)
-                    row_idx += 1
-
-            # Draw divider line
-            self.stdscr.addstr(height - 4, 0, "-" * width, self.divider_color)
-
-            # Draw prompt with custom color
-            self.stdscr.addstr(height - 3, 0, "♥ ", self.prompt_symbol_color)
-            self.stdscr.addstr(height - 3, 2, input_str, self.text_color)
-
-            # Draw status line
-            status_line = f"DB Code: {self.db_code} | HTTP: {self.http_status} | Last Save: {self.last_saved}"
-            self.stdscr.addstr(height - 1, 0, status_line, self.text_color)
-            
-            # Show suggestions if available
-            if suggestions:
-                for idx, (cmd, desc) in enumerate(suggestions):
-                    suggestion_attr = self.text_color
-                    if idx == selected_suggestion_index:
-                        suggestion_attr |= curses.A_REVERSE
-                    self.stdscr.addstr(height - 5 - idx, 0, f"{cmd} - {desc}", suggestion_attr)
-
-            self.stdscr.clrtoeol()  # Clear the rest of the line
-            self.stdscr.refresh()
+            frame = self.build_frame(height, width, input_str, suggestions, selected_suggestion_index)
+            self.render_frame(frame, height, width)
+            self.stdscr.move(height - 3, min(2 + display_width(input_str), width - 1))
+            self.stdscr.noutrefresh()
+            curses.doupdate()
         except Exception as e:
-            self.log_error(f"Error drawing screen: {e}")
+            self.log.error(f"Error drawing screen: {e}")
 
-    def add_item(self, item):
-        new_id = (self.todos[-1][0] + 1) if self.todos else 1
-        self.todos.append((new_id, item))  # Add new todo with new ID
+    def build_frame(self, height, width, input_str, suggestions, selected_suggestion_index):
+        # One list of (x, text, attr) segments per screen row; later segments overwrite earlier ones
+        frame = [[] for _ in range(height)]
 
-    def add_subitem(self, parent_id, item):
-        if parent_id not in self.subtodos:
-            self.subtodos[parent_id] = []
-        new_id = (self.subtodos[parent_id][-1][0] + 1) if self.subtodos[parent_id] else 1
-        self.subtodos[parent_id].append((new_id, item))  # Add new subtodo with new ID
-
-    def highlight_item(self, idx):
-        todo_id, _ = self.todos[idx]
-        if f"{todo_id}" in self.highlighted:
-            self.highlighted.remove(f"{todo_id}")
-        else:
-            self.highlighted.add(f"{todo_id}")
+        def put(y, x, text, attr):
+            if 0 <= y < height:
+                frame[y].append((x, text, attr))
 
-    def highlight_subitem(self, parent_id, sub_idx):
-        subtask_key = f"{parent_id}_{sub_idx}"
-        if subtask_key in self.highlighted:
-            self.highlighted.remove(subtask_key)
+        self.list_height = height - 5  # To keep space for the prompt and status lines
+        if width != self.layout_width:
+            old_width, self.layout_width = self.layout_width, width
+            if self.wrap:
+                self.relayout(old_width)
+        if self.filter_matches is not None:
+            matches = self.filter_matches
+            y = self.put_results(put, width, f"Filter '{self.fuzzy.pattern()}': {len(matches)} matches",
+                                 [(self.row_label(*key), self.row_item(*key)) for key, _, _ in matches[:self.list_height - 1]])
+        elif self.search_results is not None:
+            query, results = self.search_results
+            y = self.put_results(put, width, f"Search '{query}': {len(results)} results", results)
         else:
-            self.highlighted.add(subtask_key)
+            y = self.put_list(put, width)
 
-    def prioritize_item(self, idx):
-        todo_id, _ = self.todos[idx]
-        if f"{todo_id}" in self.priorities:
-            self.priorities.remove(f"{todo_id}")
-        else:
-            self.priorities.add(f"{todo_id}")
+        while y < self.list_height:
+            put(y, 0, "♠", self.linenumber_color)
+            y += 1
 
-    def prioritize_subitem(self, parent_id, sub_idx):
-        subtask_key = f"{parent_id}_{sub_idx}"
-        if subtask_key in self.priorities:
-            self.priorities.remove(subtask_key)
-        else:
-            self.priorities.add(subtask_key)
+        # Draw divider line
+        put(height - 4, 0, "-" * width, self.divider_color)
 
-    def bold_item(self, idx):
-        todo_id, _ = self.todos[idx]
-        if f"{todo_id}" in self.bold_notes:
-            self.bold_notes.remove(f"{todo_id}")
-        else:
-            self.bold_notes.add(f"{todo_id}")
+        # Draw prompt with custom color
+        put(height - 3, 0, "♥ ", self.prompt_symbol_color)
+        put(height - 3, 2, input_str, self.text_color)
 
-    def bold_subitem(self, parent_id, sub_idx):
-        subtask_key = f"{parent_id}_{sub_idx}"
-        if subtask_key in self.bold_notes:
-            self.bold_notes.remove(subtask_key)
+        # Draw status line
+        if self.unsaved():
+            save_status = "Unsaved changes"
         else:
-            self.bold_notes.add(subtask_key)
+            save_status = f"Saved: {self.last_saved}"
+        status_line = f"DB Code: {self.db_code} | HTTP: {self.http_status} | {save_status}"
+        if self.todo_cursor is not None:
+            status_line += f" | Loading... {len(self.todos)} todos"
+        put(height - 1, 0, status_line, self.text_color)
+
+        # Show suggestions if available
+        if suggestions:
+            for idx, (cmd, desc) in enumerate(suggestions):
+                suggestion_attr = self.text_color
+                if idx == selected_suggestion_index:
+                    suggestion_attr |= curses.A_REVERSE
+                put(height - 5 - idx, 0, f"{cmd} - {desc}", suggestion_attr)
+
+        return [tuple(line) for line in frame]
+
+    def put_results(self, put, width, header, results):
+        put(0, 0, header, self.linenumber_color)
+        y = 1
+        for label, item in results[:self.list_height - 1]:
+            x = max(4, len(label) + 1)
+            lines, attr = self.render_item(item, width - x)
+            put(y, 0, label, self.linenumber_color)
+            for line in lines[:self.list_height - y]:
+                put(y, x, line, attr)
+                y += 1
+            if y >= self.list_height:
+                break
+        return y
+
+    def put_list(self, put, width):
+        # Draw the visible window of todos
+        rows = self.row_index()
+        self.scroll_top = max(0, min(self.scroll_top, rows.total() - self.list_height))
+        idx, offset = rows.find(self.scroll_top)
+        y = 0
+        while y < self.list_height and idx < len(self.todos):
+            todo = self.todos[idx]
+            marker = self.todo_marker(todo)
+            lines, attr = self.render_item(todo, self.todo_width(todo, width))
+            # offset is the first row of this todo's block that is on screen
+            for n in range(offset, len(lines)):
+                if y >= self.list_height:
+                    break
+                if n == 0:
+                    if todo.flags & DONE:
+                        put(y, 0, "✔", self.strikethrough_icon_color)
+                    else:
+                        put(y, 0, f"{idx + 1}.", self.linenumber_color)
+                put(y, 4, lines[n], attr)
+                if n == 0 and marker:
+                    put(y, 5 + display_width(lines[0]), marker, self.linenumber_color)
+                y += 1
+            offset = max(offset - len(lines), 0)
+
+            # Draw subtodos if the todo is expanded
+            subitems = self.subitems(todo.id) if todo.id in self.expanded else []
+            j = 0
+            if not self.wrap:
+                j, offset = offset, 0  # One row each, jump straight to the first one shown
+            while j < len(subitems) and offset >= self.item_lines(subitems[j], width - 8):
+                offset -= self.item_lines(subitems[j], width - 8)
+                j += 1
+            while j < len(subitems) and y < self.list_height:
+                subtodo = subitems[j]
+                lines, attr = self.render_item(subtodo, width - 8)
+                for n in range(offset, len(lines)):
+                    if y >= self.list_height:
+                        break
+                    if n == 0:
+                        if subtodo.flags & DONE:
+                            put(y, 4, "✔", self.strikethrough_icon_color)
+                        else:
+                            put(y, 4, chr(97 + j) + ".", self.linenumber_color)
+                    put(y, 8, lines[n], attr)
+                    y += 1
+                offset = 0
+                j += 1
+            idx += 1
+            offset = 0
+
+        return y
 
-    def italic_item(self, idx):
-        todo_id, _ = self.todos[idx]
-        if f"{todo_id}" in self.italic_notes:
-            self.italic_notes.remove(f"{todo_id}")
+    def render_frame(self, frame, height, width):
+        if self.last_frame is None or self.frame_size != (height, width):
+            self.stdscr.clear()  # Forces a full repaint of the terminal
+            self.last_frame = [None] * height
+            self.frame_size = (height, width)
+        for y, line in enumerate(frame):
+            if line == self.last_frame[y]:
+                continue
+            # Writing the bottom-right cell moves the cursor off screen and returns ERR
+            line_width = width - 1 if y == height - 1 else width
+            self.stdscr.addstr(y, 0, " " * line_width, self.background_color_pair)
+            for x, text, attr in line:
+                if x < line_width:
+                    self.stdscr.addstr(y, x, fit(text, line_width - x), attr)
+            self.last_frame[y] = line
+
+    def render_item(self, item, available):
+        # Items never change content in place, so content and flags cover every mutation
+        return self.render_cache.get((item.id, item.content, item.flags, available, self.wrap),
+                                     lambda: self.prepare_item(item, available))
+
+    def prepare_item(self, item, available):
+        # -> (display lines, attr); one line cut to the width unless wrapping is on
+        if self.wrap:
+            lines = wrap_lines(item.content, available)
         else:
-            self.italic_notes.add(f"{todo_id}")
+            lines = [truncate(item.content, available)]
+        if item.flags & DONE:
+            lines = [strikethrough(line) for line in lines]
+        return lines, self.item_attr(item)
+
+    def item_attr(self, item):
+        attr = self.text_color
+        if item.flags & PRIORITY:
+            attr |= curses.A_BOLD
+        if item.flags & BOLD:
+            attr |= curses.A_BOLD | self.bold_color
+        if item.flags & ITALIC:
+            attr = self.italic_color
+        return attr
+
+    def invalidate(self):
+        self.last_frame = None
+
+    def row_index(self):
+        if self.todo_rows.dirty:
+            self.todo_rows.rebuild(self.row_weight(todo) for todo in self.todos)
+        return self.todo_rows
+
+    def row_weight(self, todo):
+        # Screen rows a todo takes; a collapsed one hides its subtodos, a wrapped item takes one per line
+        if not self.wrap:
+            if todo.id in self.expanded:
+                return 1 + self.subtodo_counts.get(todo.id, 0)
+            return 1
+        rows = self.item_lines(todo, self.todo_width(todo, self.layout_width))
+        if todo.id in self.expanded:
+            rows += sum(self.item_lines(subtodo, self.layout_width - 8) for subtodo in self.subitems(todo.id))
+        return rows
+
+    def relayout(self, old_width):
+        # Only items that take more than one line at the narrower width change their row count
+        rows = self.todo_rows
+        if rows.dirty:
+            return
+        longest_marker = len(f"[+{max(self.subtodo_counts.values(), default=0)}]")
+        fits = min(old_width, self.layout_width) - 5 - longest_marker  # Cells every todo text gets
+        weights = rows.weights()
+        for idx, todo in enumerate(self.todos):
+            length = len(todo.content)
+            # A character takes at most two cells, only one when the text is ASCII
+            if todo.id in self.expanded or (length * 2 > fits and (length > fits or not todo.content.isascii())):
+                weights[idx] = self.row_weight(todo)
+        rows.rebuild(weights)
+
+    def item_lines(self, item, available):
+        return line_count(item.content, available) if self.wrap else 1
+
+    def todo_marker(self, todo):
+        # Shown after a collapsed todo that has subtodos
+        count = self.subtodo_counts.get(todo.id, 0)
+        if count and todo.id not in self.expanded:
+            return f"[+{count}]"
+        return ""
+
+    def todo_width(self, todo, width):
+        # Cells left for the todo text once the number and the marker have their room
+        marker = self.todo_marker(todo)
+        if marker:
+            return width - 5 - len(marker)
+        return width - 4
+
+    def todo_index(self, todo_id):
+        # Todo ids only grow, so self.todos is sorted by id
+        idx = bisect_left(self.todos, todo_id, key=lambda todo: todo.id)
+        return idx if idx < len(self.todos) and self.todos[idx].id == todo_id else None
+
+    def scroll(self, delta):
+        # Clamped to the list length by the next draw
+        self.scroll_top = max(0, self.scroll_top + delta)
+
+    def add_item(self, item):
+        new_id = new_item_id(self.todos[-1].id if self.todos else 0)
+        todo = Item(new_id, item)  # Add new todo with new ID
+        self.todos.append(todo)
+        self.changes.insert_todo(todo)
+        self.journal.record(["drop_rows", [new_id], []], ["restore_rows", [[new_id, item, 0]], []])
+        self.todo_rows.append(self.row_weight(todo))
+        # Keep the new todo on screen
+        self.scroll_top = max(self.scroll_top, self.row_index().total() - self.list_height)
+
+    def add_subitem(self, parent_id, item):
+        idx = self.todo_index(parent_id)
+        before = self.row_weight(self.todos[idx]) if idx is not None else 0
+        # subtodos.id is the table's primary key, so it must be unique across parents
+        subtodo = Item(new_item_id(self.next_subtodo_id - 1), item)
+        self.next_subtodo_id = subtodo.id + 1
+        self.subitems(parent_id).append(subtodo)
+        self.subtodo_counts[parent_id] = self.subtodo_counts.get(parent_id, 0) + 1
+        self.changes.insert_subtodo(parent_id, subtodo)
+        self.journal.record(["drop_rows", [], [[parent_id, subtodo.id]]], ["restore_rows", [], [[parent_id, subtodo.id, item, 0]]])
+        self.expanded.add(parent_id)  # Show the new subtodo
+        if idx is not None:
+            self.todo_rows.add(idx, self.row_weight(self.todos[idx]) - before)
+
+    def toggle_item(self, idx, flag):
+        todo = self.todos[idx]
+        self.journal.record(["set_flags", [[todo.id, None, flag, todo.flags & flag]]],
+                            ["set_flags", [[todo.id, None, flag, ~todo.flags & flag]]])
+        todo.flags ^= flag
+        if flag & (DONE | PRIORITY):
+            self.changes.update_todo(todo)
+
+    def toggle_subitem(self, parent_id, sub_idx, flag):
+        if 0 <= sub_idx < self.subtodo_counts.get(parent_id, 0):
+            subtodo = self.subitems(parent_id)[sub_idx]
+            self.journal.record(["set_flags", [[parent_id, subtodo.id, flag, subtodo.flags & flag]]],
+                                ["set_flags", [[parent_id, subtodo.id, flag, ~subtodo.flags & flag]]])
+            subtodo.flags ^= flag
+            if flag & (DONE | PRIORITY):
+                self.changes.update_subtodo(subtodo)
+
+    def delete_rows(self, todo_ids, subtodo_ids):
+        # Rows are matched by id in one pass over the list, however many go at once.
+        # subtodo_ids maps parent id -> ids of the subtodos to drop
+        recording = self.journal.recording()
+        removed_todos, removed_subtodos = [], []  # [id, content, flags] rows for undo
+        for parent_id, ids in subtodo_ids.items():
+            if parent_id in todo_ids:
+                continue  # Goes with its parent
+            idx = self.todo_index(parent_id)
+            before = self.row_weight(self.todos[idx]) if idx is not None else 0
+            kept = []
+            for subtodo in self.subitems(parent_id):
+                if subtodo.id in ids:
+                    self.changes.delete_subtodo(subtodo.id)
+                    removed_subtodos.append([parent_id, subtodo.id, subtodo.content, subtodo.flags])
+                else:
+                    kept.append(subtodo)
+            self.subtodos[parent_id] = kept
+            self.subtodo_counts[parent_id] = len(kept)
+            if idx is not None and not todo_ids:
+                self.todo_rows.add(idx, self.row_weight(self.todos[idx]) - before)
+        if todo_ids:
+            kept = []
+            for todo in self.todos:
+                if todo.id in todo_ids:
+                    if recording:
+                        # Undo needs the children too, including ones never read so far
+                        removed_todos.append([todo.id, todo.content, todo.flags])
+                        removed_subtodos.extend([todo.id, subtodo.id, subtodo.content, subtodo.flags]
+                                                for subtodo in self.subitems(todo.id))
+                    # Children never read have no pending changes, the SQL delete covers them
+                    self.changes.delete_todo(todo.id, self.subtodos.pop(todo.id, []))
+                    self.subtodo_counts.pop(todo.id, None)
+                    self.expanded.discard(todo.id)
+                else:
+                    kept.append(todo)
+            self.todos = kept
+            self.todo_rows.dirty = True
+        if removed_todos or removed_subtodos:
+            dropped = {row[0] for row in removed_todos}
+            self.journal.record(["restore_rows", removed_todos, removed_subtodos],
+                                ["drop_rows", sorted(dropped), [row[:2] for row in removed_subtodos if row[0] not in dropped]])
 
-    def italic_subitem(self, parent_id, sub_idx):
-        subtask_key = f"{parent_id}_{sub_idx}"
-        if subtask_key in self.italic_notes:
-            self.italic_notes.remove(subtask_key)
+    def drop_rows(self, todo_ids, subtodo_refs):
+        # delete_rows with the JSON-friendly arguments the journal stores
+        subtodo_ids = {}
+        for parent_id, subtodo_id in subtodo_refs:
+            subtodo_ids.setdefault(parent_id, set()).add(subtodo_id)
+        self.delete_rows(set(todo_ids), subtodo_ids)
+
+    def restore_rows(self, todos, subtodos):
+        # Puts rows back at their place by id; a row still present is replaced
+        if todos:
+            restored = [Item(todo_id, content, flags) for todo_id, content, flags in todos]
+            ids = {item.id for item in restored}
+            # Two sorted runs, so the sort is a single merge
+            self.todos = sorted([todo for todo in self.todos if todo.id not in ids] + restored, key=lambda todo: todo.id)
+            for item in restored:
+                self.changes.insert_todo(item)
+            self.todo_rows.dirty = True
+        grouped = {}
+        for parent_id, subtodo_id, content, flags in subtodos:
+            grouped.setdefault(parent_id, []).append(Item(subtodo_id, content, flags))
+        for parent_id, restored in grouped.items():
+            idx = self.todo_index(parent_id)
+            if idx is None:
+                continue  # The parent is gone
+            before = self.row_weight(self.todos[idx])
+            ids = {item.id for item in restored}
+            items = sorted([item for item in self.subitems(parent_id) if item.id not in ids] + restored, key=lambda item: item.id)
+            self.subtodos[parent_id] = items
+            self.subtodo_counts[parent_id] = len(items)
+            for item in restored:
+                self.changes.insert_subtodo(parent_id, item)
+            self.todo_rows.add(idx, self.row_weight(self.todos[idx]) - before)
+
+    def set_flags(self, entries):
+        # [todo id, subtodo id or None, mask, value]: the bits in mask are set to value
+        for todo_id, subtodo_id, mask, value in entries:
+            idx = self.todo_index(todo_id)
+            if idx is None:
+                continue
+            if subtodo_id is None:
+                item = self.todos[idx]
+            else:
+                item = next((subtodo for subtodo in self.subitems(todo_id) if subtodo.id == subtodo_id), None)
+                if item is None:
+                    continue
+            item.flags = item.flags & ~mask | value
+            if mask & (DONE | PRIORITY):
+                if subtodo_id is None:
+                    self.changes.update_todo(item)
+                else:
+                    self.changes.update_subtodo(item)
+
+    def apply_journal(self, ops):
+        for name, *args in ops:
+            if name in JOURNAL_OPS:
+                getattr(self, name)(*args)
+
+    def commit_step(self):
+        # Stores what the command just did as one undo step and logs it for replay until the next save;
+        # the save worker writes both ahead of the table edits that follow
+        ops = self.journal.end()
+        if not ops:
+            return
+        undo = json.dumps([undo for undo, _ in reversed(ops)])
+        redo = json.dumps([redo for _, redo in ops])
+        self.write_journal(self.journal.add_step(undo, redo))
+
+    def write_journal(self, statements):
+        self.save_worker.submit((statements, [], False, 0))
+
+    def undo(self):
+        self.journal.end()  # Undo is not a step of its own
+        self.replay_step(0)
+
+    def redo(self):
+        self.journal.end()
+        self.replay_step(1)
+
+    def replay_step(self, done):
+        step = self.journal.replay(done)
+        if step is None:
+            return
+        ops, statements = step
+        self.apply_journal(json.loads(ops))
+        self.write_journal(statements)
+
+    def toggle_ref(self, ref, flag):
+        idx, sub_idx = ref
+        if sub_idx is None:
+            self.toggle_item(idx, flag)
         else:
-            self.italic_notes.add(subtask_key)
-
-    def delete_item(self, idx):
-        todo_id, _ = self.todos[idx]
-        del self.todos[idx]
-        if todo_id in self.subtodos:
-            del self.subtodos[todo_id]
-        self.highlighted = {i for i in self.highlighted if i != f"{todo_id}" and not str(i).startswith(f"{todo_id}_")}
-        self.priorities = {i for i in self.priorities if i != f"{todo_id}" and not str(i).startswith(f"{todo_id}_")}
-        self.bold_notes = {i for i in self.bold_notes if i != f"{todo_id}" and not str(i).startswith(f"{todo_id}_")}
-        self.italic_notes = {i for i in self.italic_notes if i != f"{todo_id}" and not str(i).startswith(f"{todo_id}_")}
-
-    def delete_subitem(self, parent_id, sub_idx):
-        if parent_id in self.subtodos and sub_idx < len(self.subtodos[parent_id]):
-            del self.subtodos[parent_id][sub_idx]
-            self.highlighted = {i for i in self.highlighted if i != f"{parent_id}_{sub_idx}"}
-            self.priorities = {i for i in self.priorities if i != f"{parent_id}_{sub_idx}"}
-            self.bold_notes = {i for i in self.bold_notes if i != f"{parent_id}_{sub_idx}"}
-            self.italic_notes = {i for i in self.italic_notes if i != f"{parent_id}_{sub_idx}"}
-
-    def handle_input(self, input_str):
+            self.toggle_subitem(self.todos[idx].id, sub_idx, flag)
+
+    def toggle_refs(self, refs, flag):
+        # The batch ends up flagged, or cleared when every item in it already was
+        refs = [ref for ref in dict.fromkeys(refs) if self.has_row(*ref)]
+        setting = not all(self.row_item(*ref).flags & flag for ref in refs)
+        for ref in refs:
+            if bool(self.row_item(*ref).flags & flag) != setting:
+                self.toggle_ref(ref, flag)
+
+    def set_wrap(self, mode):
+        if mode in ("on", "off"):
+            self.wrap = mode == "on"
+            self.todo_rows.dirty = True
+
+    def toggle_expanded(self, refs):
+        # Like toggle_refs: the batch opens, or closes when every todo in it already was open
+        indices = [idx for idx in dict.fromkeys(idx for idx, _ in refs) if self.has_row(idx, None)]
+        expanding = not all(self.todos[idx].id in self.expanded for idx in indices)
+        for idx in indices:
+            todo = self.todos[idx]
+            before = self.row_weight(todo)
+            if expanding:
+                self.expanded.add(todo.id)
+            else:
+                self.expanded.discard(todo.id)
+            self.todo_rows.add(idx, self.row_weight(todo) - before)
+
+    def add_subitem_at(self, idx, item):
+        self.add_subitem(self.todos[idx].id, item)
+
+    def delete_refs(self, refs):
+        # Positions refer to the list on screen, so resolve them all before anything moves
+        todo_ids, subtodo_ids = set(), {}
+        for idx, sub_idx in refs:
+            if not self.has_row(idx, sub_idx):
+                continue
+            if sub_idx is None:
+                todo_ids.add(self.todos[idx].id)
+            else:
+                subtodo_ids.setdefault(self.todos[idx].id, set()).add(self.row_item(idx, sub_idx).id)
+        self.delete_rows(todo_ids, subtodo_ids)
+
+    def pin_filter(self):
+        self.filter_live = False  # Keep the matches on screen
+
+    def quit(self):
+        self.save_todos()
+        # Let a running sync finish so its results reach the local database
+        self.sync_worker.stop(HTTP_TIMEOUT[1])
+        self.save_worker.stop()
+        self.close_connection()
+        return False  # Signal to exit the app
+
+    def handle_input(self, input_str, command=None):
         try:
-            if input_str.isdigit():
-                idx = int(input_str) - 1
-                self.highlight_item(idx)
-            elif input_str[0].isdigit() and input_str[1] == ' ':
-                parts = input_str.split(' ', 1)
-                if len(parts) == 2:
-                    parent_idx = int(parts[0]) - 1
-                    subitem = parts[1].strip()
-                    self.add_subitem(self.todos[parent_idx][0], subitem)
-            elif input_str[0].isdigit() and len(input_str) > 1 and input_str[1].isalpha():
-                parent_idx = int(input_str[0]) - 1
-                sub_idx = ord(input_str[1]) - 97
-                self.highlight_subitem(self.todos[parent_idx][0], sub_idx)
-            elif input_str.startswith(":d "):
-                try:
-                    idx = int(input_str[3:]) - 1
-                    self.highlight_item(idx)
-                except ValueError:
-                    pass
-            elif input_str.startswith(":p "):
-                try:
-                    idx = int(input_str[3:]) - 1
-                    self.prioritize_item(idx)
-                except ValueError:
-                    pass
-            elif input_str.startswith(":b "):
+            self.finish_loading()
+            if not input_str.startswith("/"):
+                self.search_results = None  # Any other command goes back to the list
+            if not input_str.startswith("?"):
+                self.filter_matches = None
+                self.fuzzy.reset()  # Row positions may change from here on
+            if command is None:
+                command = parse_input(input_str)
+            if command is not None:
+                method, args = command
+                self.journal.begin()
                 try:
-                    idx = int(input_str[3:]) - 1
-                    self.bold_item(idx)
-                except ValueError:
-                    pass
-            elif input_str.startswith(":i "):
-                try:
-                    idx = int(input_str[3:]) - 1
-                    self.italic_item(idx)
-                except ValueError:
-                    pass
-            elif input_str.startswith(":x "):
-                try:
-                    ranges = input_str[3:].split(',')
-                    indices = []
-                    for range_str in ranges:
-                        if '-' in range_str:
-                            start, end = map(int, range_str.split('-'))
-                            indices.extend(range(start-1, end))
-                        else:
-                            if range_str[0].isdigit() and len(range_str) > 1 and range_str[1].isalpha():
-                                parent_idx = int(range_str[0]) - 1
-                                sub_idx = ord(range_str[1]) - 97
-                                self.delete_subitem(self.todos[parent_idx][0], sub_idx)
-                            else:
-                                indices.append(int(range_str) - 1)
-                    for idx in sorted(indices, reverse=True):
-                        self.delete_item(idx)
-                except ValueError:
-                    pass
-            elif input_str.startswith(":theme "):
-                theme_name = input_str[7:].strip().lower()
-                self.apply_theme(theme_name)
-            elif input_str.strip() == ":q":
-                self.save_todos()
-                return False  # Signal to exit the app
-            elif input_str.strip() == ":s":
-                self.save_to_http()
-            elif input_str.strip() == ":check":
-                if self.check_db_on_http():
-                    self.stdscr.addstr(0, 0, "Database is present on HTTP server.", curses.color_pair(2))
-                else:
-                    self.stdscr.addstr(0, 0, "Database is not present on HTTP server.", curses.color_pair(2))
-                self.stdscr.refresh()
-                self.stdscr.getch()
-            else:
-                self.add_item(input_str)
-            self.save_todos()  # Save todos after each modification
+                    if getattr(self, method)(*args) is False:
+                        return False
+                finally:
+                    self.commit_step()
+            self.schedule_save()  # Written shortly, together with the edits that follow
             return True
         except Exception as e:
-            self.log_error(f"Error handling input: {e}")
+            self.log.error(f"Error handling input: {e}")
             return True
 
+    def handle_paste(self, text):
+        # Several pasted lines become one todo each, in a single undo step and save;
+        # -> what is left for the prompt
+        lines = [line.strip() for line in text.splitlines() if line.strip()]
+        if len(lines) < 2:
+            return " ".join(lines)
+        self.handle_input("", ("add_items", (lines,)))
+        return ""
+
+    def add_items(self, items):
+        for item in items:
+            self.add_item(item)
+
     def get_suggestions(self, input_str):
         if input_str.startswith(":"):
-            return [(cmd, desc) for cmd, desc in COMMANDS.items() if cmd.startswith(input_str)]
+            return [(cmd, COMMANDS[cmd]) for cmd in COMMAND_TRIE.complete(input_str)]
         return []
 
-    def log_error(self, message):
-        with open("error.log", "a") as log_file:
-            log_file.write(message + "\n")
-
     def run(self):
-        curses.echo()
+        curses.noecho()  # draw renders the prompt itself
         input_str = ""
         suggestions = []
         selected_suggestion_index = None
         running = True
-        while running:
-            self.draw(input_str, suggestions, selected_suggestion_index)
-            key = self.stdscr.getch()
-
-            if key == curses.KEY_BACKSPACE or key == 127:
-                input_str = input_str[:-1]
-                suggestions = self.get_suggestions(input_str)
-                selected_suggestion_index = 0 if suggestions else None
-            elif key == 9 and input_str.startswith(":"):  # Tab key
-                suggestions = self.get_suggestions(input_str)
-                selected_suggestion_index = 0 if suggestions else None
-            elif key == curses.KEY_UP and suggestions:
-                if selected_suggestion_index is not None:
-                    selected_suggestion_index = (selected_suggestion_index - 1) % len(suggestions)
-            elif key == curses.KEY_DOWN and suggestions:
-                if selected_suggestion_index is not None:
-                    selected_suggestion_index = (selected_suggestion_index + 1) % len(suggestions)
-            elif key == 10:  # Enter key
-                if selected_suggestion_index is not None and suggestions:
-                    input_str = suggestions[selected_suggestion_index][0]
-                    suggestions = []
-                    selected_suggestion_index = None
-                else:
-                    running = self.handle_input(input_str)
-                    input_str = ""
-                    suggestions = []
-                    selected_suggestion_index = None
-            else:
-                input_str += chr(key)
-                suggestions = self.get_suggestions(input_str)
-                selected_suggestion_index = 0 if suggestions else None
-            self.stdscr.clear()
+        # getch returns -1 when idle so sync results show up; it does not wait at all while rows are loading
+        loading = self.todo_cursor is not None
+        for name in EXIT_SIGNALS:
+            if hasattr(signal, name):
+                signal.signal(getattr(signal, name), self.exit_on_signal)
+        sys.stdout.write(BRACKETED_PASTE[0])
+        sys.stdout.flush()
+        try:
+            while running:
+                self.sync_worker.poll()
+                self.save_worker.poll()
+                self.autosave()
+                self.load_more()
+                if loading and self.todo_cursor is None:
+                    loading = False
+                self.draw(input_str, suggestions, selected_suggestion_index)
+                self.stdscr.timeout(self.idle_timeout(loading))
+                key = self.stdscr.getch()
+                if key == -1:
+                    continue
+                # Everything that arrived together is handled before the next draw
+                keys = read_keys(self.stdscr, key)
+                edited = False  # Suggestions and filter follow the prompt once per run of edits
+                for kind, key in split_keys(keys):
+                    if kind == "text":
+                        input_str += key
+                        edited = True
+                        continue
+                    if kind == "paste":
+                        input_str += self.handle_paste(key)
+                        edited = True
+                        continue
+                    if key == curses.KEY_BACKSPACE or key == 127:
+                        input_str = input_str[:-1]
+                        edited = True
+                        continue
+                    if edited:
+                        suggestions = self.get_suggestions(input_str)
+                        selected_suggestion_index = 0 if suggestions else None
+                        self.update_filter(input_str)
+                        edited = False
+
+                    if key == 9 and input_str.startswith(":"):  # Tab key
+                        suggestions = self.get_suggestions(input_str)
+                        selected_suggestion_index = 0 if suggestions else None
+                    elif key == curses.KEY_UP and suggestions:
+                        if selected_suggestion_index is not None:
+                            selected_suggestion_index = (selected_suggestion_index - 1) % len(suggestions)
+                    elif key == curses.KEY_DOWN and suggestions:
+                        if selected_suggestion_index is not None:
+                            selected_suggestion_index = (selected_suggestion_index + 1) % len(suggestions)
+                    elif key == curses.KEY_NPAGE:
+                        self.scroll(self.list_height)
+                    elif key == curses.KEY_PPAGE:
+                        self.scroll(-self.list_height)
+                    elif key == curses.KEY_HOME:
+                        self.scroll_top = 0
+                    elif key == curses.KEY_END:
+                        self.finish_loading()
+                        self.scroll_top = self.row_index().total()
+                    elif key == 10:  # Enter key
+                        if selected_suggestion_index is not None and suggestions:
+                            input_str = suggestions[selected_suggestion_index][0]
+                            suggestions = []
+                            selected_suggestion_index = None
+                        else:
+                            running = self.handle_input(input_str)
+                            input_str = ""
+                            suggestions = []
+                            selected_suggestion_index = None
+                            if not running:
+                                break
+                    else:
+                        input_str += chr(key)
+                        edited = True
+                if edited:
+                    suggestions = self.get_suggestions(input_str)
+                    selected_suggestion_index = 0 if suggestions else None
+                    self.update_filter(input_str)
+        except (KeyboardInterrupt, SystemExit):
+            self.save_todos()
+            raise
+        finally:
+            sys.stdout.write(BRACKETED_PASTE[1])
+            sys.stdout.flush()
+
+    def exit_on_signal(self, signum, frame):
+        raise SystemExit(128 + signum)  # run saves on the way out
+
+class BatchScreen:
+    # ToDoApp only asks the window for its size before run, and exec never draws
+    def getmaxyx(self):
+        return (24, 80)
+
+class BatchConnection(sqlite3.Connection):
+    # "with conn:" blocks become savepoints, so a whole exec run is one transaction
+    def __enter__(self):
+        if not self.in_transaction:
+            self.execute('BEGIN')
+        self.execute('SAVEPOINT block')
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.execute('ROLLBACK TO block')
+        self.execute('RELEASE block')
+        return False
+
+class BatchApp(ToDoApp):
+    # Runs prompt commands without curses; nothing is committed before finish
+    def __init__(self, db_code):
+        self.batch_code = db_code
+        super().__init__(BatchScreen())
+
+    def init_colors(self):
+        pass
+
+    def apply_theme(self, theme_name):
+        if theme_name in THEMES:
+            self.current_theme = theme_name
+
+    def initialize_database(self):
+        self.db_code = self.batch_code
+        self.db_file = f"{self.db_code}.db"
+        self.create_db_if_not_exists()
+
+    def get_connection(self):
+        if self.conn is None:
+            self.conn = open_database(self.db_file, BatchConnection)
+        return self.conn
+
+    def run(self):
+        pass
+
+    def execute(self, commands):
+        # -> number of commands run; stops early at :q
+        count = 0
+        for command in commands:
+            count += 1
+            if self.handle_input(command.rstrip("\r\n")) is False:
+                break
+        return count
+
+    def write_journal(self, statements):
+        with self.get_connection() as conn:
+            write_save(conn.cursor(), statements, [], False, 0)
+
+    def flush_save(self):
+        # Straight into the open transaction instead of through the save worker
+        self.save_due = None
+        self.unsaved_commands = 0
+        batch = self.take_save()
+        if batch is not None:
+            with self.get_connection() as conn:
+                write_save(conn.cursor(), *batch)
+            self.finish_save(0)
+
+    def upload_db(self):
+        self.get_connection().commit()  # The upload reads the file, which only has committed pages
+        super().upload_db()
+
+    def quit(self):
+        return False  # finish saves, commits and closes
+
+    def finish(self):
+        self.save_todos()
+        self.sync_worker.stop(HTTP_TIMEOUT[1])  # A :s or :check in the batch reports back here
+        self.save_todos()
+        self.get_connection().commit()
+        self.save_worker.stop()
+        self.close_connection()
+
+def batch_main(argv):
+    parser = argparse.ArgumentParser(prog="todocloud.py", description="Run todo commands without the interface.")
+    commands = parser.add_subparsers(dest="mode", required=True)
+    exec_parser = commands.add_parser("exec", help="run prompt commands, from the arguments or one per line from stdin")
+    exec_parser.add_argument("--code", help="database code, the one in db_code.txt by default")
+    exec_parser.add_argument("commands", nargs="*", help="commands as typed at the prompt; none or '-' reads stdin")
+    args = parser.parse_args(argv)
+
+    code = args.code
+    if code is None:
+        if not os.path.exists("db_code.txt"):
+            parser.error("no --code given and no db_code.txt")
+        with open("db_code.txt") as f:
+            code = f.read().strip()
+    if args.commands in ([], ["-"]):
+        lines = sys.stdin
+    else:
+        lines = args.commands
+    app = BatchApp(code)
+    count = app.execute(lines)
+    app.finish()
+    logging.shutdown()
+    print(f"{count} commands applied to {app.db_file}", file=sys.stderr)
+    return 0
 
 def main(stdscr):
     try:
         app = ToDoApp(stdscr)
     except Exception as e:
-        with open("error.log", "a") as log_file:
-            log_file.write(f"Critical error: {e}\n")
+        setup_logger().critical(f"Critical error: {e}")
 
-curses.wrapper(main)
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        sys.exit(batch_main(sys.argv[1:]))
+    curses.wrapper(main)
@@ -0,0 +1,231 @@
+import bisect
+import gzip
+import hashlib
+import http.server
+import json
+import os
+import sqlite3
+import threading
+import urllib.parse
+from email import policy
+from email.parser import BytesParser
+from email.utils import formatdate, parsedate_to_datetime
+
+HOST = '127.0.0.1'
+PORT = 5000
+UPLOAD_ENDPOINT = '/upload'
+SYNC_ENDPOINT = '/sync'
+UPLOAD_FOLDER = 'uploads'
+
+# Must match SYNC_OPS in todocloud.py
+SYNC_OPS = {
+    "delete_subtodo": ['DELETE FROM subtodos WHERE id = ?'],
+    "delete_todo": ['DELETE FROM subtodos WHERE parent_id = ?', 'DELETE FROM todos WHERE id = ?'],
+    "insert_todo": ['INSERT OR REPLACE INTO todos (id, content, highlighted, priority) VALUES (?, ?, ?, ?)'],
+    "update_todo": ['UPDATE todos SET highlighted = ?, priority = ? WHERE id = ?'],
+    "insert_subtodo": ['INSERT OR REPLACE INTO subtodos (id, parent_id, content, highlighted, priority) VALUES (?, ?, ?, ?, ?)'],
+    "update_subtodo": ['UPDATE subtodos SET highlighted = ?, priority = ? WHERE id = ?'],
+}
+
+def valid_change(change):
+    # [op, args], with one plain value per parameter of the op's statements
+    if not isinstance(change, list) or len(change) != 2:
+        return False
+    op, args = change
+    return (isinstance(op, str) and op in SYNC_OPS and isinstance(args, list)
+            and all(statement.count('?') == len(args) for statement in SYNC_OPS[op])
+            and all(arg is None or isinstance(arg, (int, float, str)) for arg in args))
+
+class SyncLog:
+    # Row-level changes received per database since its last full upload
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.seq = 0
+        self.bases = {}  # file name -> seq of its last full upload
+        self.entries = {}  # file name -> [(seq, op, args)]
+
+    def reset(self, name):
+        self.bases[name] = self.seq
+        self.entries[name] = []
+
+    def changes_since(self, name, since):
+        if name not in self.bases:
+            # Known file but no log, e.g. after a server restart
+            self.reset(name)
+        if since is None:
+            return []
+        if since < self.bases[name] or since > self.seq:
+            return None
+        return [[op, args] for seq, op, args in self.entries[name] if seq > since]
+
+    def append(self, name, changes):
+        for op, args in changes:
+            self.seq += 1
+            self.entries[name].append((self.seq, op, args))
+
+def file_headers(path, data):
+    # Validators for conditional GETs; the ETag is the content hash, so identical copies match
+    return {
+        'ETag': '"' + hashlib.sha256(data).hexdigest() + '"',
+        'Last-Modified': formatdate(os.path.getmtime(path), usegmt=True),
+    }
+
+class TodoServerHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # Keep-alive, every response sets Content-Length
+
+    def db_path(self, prefix):
+        name = os.path.basename(self.path[len(prefix) + 1:])
+        if not self.path.startswith(prefix + '/') or not name.endswith('.db'):
+            return None, None
+        return name, os.path.join(UPLOAD_FOLDER, name)
+
+    def send_body(self, status, body=b'', content_type='application/octet-stream', headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, str(value))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def send_json(self, status, data, headers=None):
+        self.send_body(status, json.dumps(data).encode(), 'application/json', headers)
+
+    def read_body(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        return body
+
+    def not_modified(self, headers):
+        # If-None-Match wins over If-Modified-Since when a client sends both
+        tags = self.headers.get('If-None-Match')
+        if tags is not None:
+            return tags.strip() == '*' or headers['ETag'] in [tag.strip() for tag in tags.split(',')]
+        since = self.headers.get('If-Modified-Since')
+        if since is not None:
+            try:
+                return parsedate_to_datetime(headers['Last-Modified']) <= parsedate_to_datetime(since)
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    def do_HEAD(self):
+        self.do_GET()
+
+    def do_GET(self):
+        path, _, query = self.path.partition('?')
+        if path.rstrip('/') == UPLOAD_ENDPOINT:
+            self.send_listing(urllib.parse.parse_qs(query))
+            return
+        name, path = self.db_path(UPLOAD_ENDPOINT)
+        if path is None or not os.path.exists(path):
+            self.send_body(404)
+            return
+        log = self.server.sync_log
+        with log.lock:
+            log.changes_since(name, None)
+            with open(path, 'rb') as f:
+                data = f.read()
+            headers = file_headers(path, data)
+            headers['X-Sync-Seq'] = log.seq
+            if self.not_modified(headers):
+                self.send_body(304, headers=headers)
+            else:
+                self.send_body(200, data, headers=headers)
+
+    def send_listing(self, params):
+        # Pages of at most limit names after the given one; X-Next-After is where the next page starts
+        files = sorted(f for f in os.listdir(UPLOAD_FOLDER) if f.endswith('.db'))
+        if 'after' in params:
+            files = files[bisect.bisect_right(files, params['after'][0]):]
+        headers = {}
+        if 'limit' in params:
+            try:
+                limit = int(params['limit'][0])
+            except ValueError:
+                self.send_body(400)
+                return
+            if limit > 0 and len(files) > limit:
+                files = files[:limit]
+                headers['X-Next-After'] = files[-1]
+        self.send_json(200, files, headers)
+
+    def do_POST(self):
+        if self.path.rstrip('/') == UPLOAD_ENDPOINT:
+            self.handle_upload()
+        elif self.path.startswith(SYNC_ENDPOINT + '/'):
+            self.handle_sync()
+        else:
+            self.send_body(404)
+
+    def handle_upload(self):
+        content_type = self.headers.get('Content-Type', '')
+        message = BytesParser(policy=policy.HTTP).parsebytes(
+            f"Content-Type: {content_type}\r\n\r\n".encode() + self.read_body())
+        for part in message.iter_parts():
+            name = os.path.basename(part.get_filename() or '')
+            if part.get_param('name', header='content-disposition') == 'file' and name.endswith('.db'):
+                log = self.server.sync_log
+                path = os.path.join(UPLOAD_FOLDER, name)
+                data = part.get_payload(decode=True)
+                with log.lock:
+                    with open(path, 'wb') as f:
+                        f.write(data)
+                    log.reset(name)
+                    # The client already holds this copy; the validators let it skip the next download
+                    headers = file_headers(path, data)
+                    headers['X-Sync-Seq'] = log.seq
+                    self.send_json(200, {"file": name}, headers=headers)
+                return
+        self.send_body(400)
+
+    def handle_sync(self):
+        name, path = self.db_path(SYNC_ENDPOINT)
+        if path is None or not os.path.exists(path):
+            self.send_body(404)
+            return
+        try:
+            request = json.loads(self.read_body())
+            if not isinstance(request, dict) or not isinstance(request.get("changes"), list):
+                raise ValueError("not a sync request")
+            changes = request["changes"]
+            since = request.get("since")
+            if since is not None and (not isinstance(since, int) or isinstance(since, bool)):
+                raise ValueError("bad since")
+            if not all(valid_change(change) for change in changes):
+                raise ValueError("bad operation")
+        except ValueError:  # Also covers bodies that are not JSON or not UTF-8
+            self.send_body(400)
+            return
+        log = self.server.sync_log
+        with log.lock:
+            missed = log.changes_since(name, since)
+            if missed is None:
+                # The client's base is gone, it has to upload a full copy
+                self.send_body(409)
+                return
+            conn = sqlite3.connect(path)
+            try:
+                with conn:
+                    cursor = conn.cursor()
+                    for op, args in changes:
+                        for statement in SYNC_OPS[op]:
+                            cursor.execute(statement, args)
+            except sqlite3.Error:
+                self.send_body(500)  # Rolled back, nothing is logged
+                return
+            finally:
+                conn.close()
+            log.append(name, changes)
+            self.send_json(200, {"seq": log.seq, "changes": missed})
+
+def serve(host=HOST, port=PORT):
+    os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+    server = http.server.ThreadingHTTPServer((host, port), TodoServerHandler)
+    server.sync_log = SyncLog()
+    server.serve_forever()
+
+if __name__ == "__main__":
+    serve()
@@ -1,8 +1,29 @@
 import curses
 import sqlite3
+import logging
+import logging.handlers
+import threading
+import time
 
 DB_FILE = '/var/lib/todo_app/todos.db'
 
+# Applied to the long-lived connection opened by ToDoApp.get_connection
+DB_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",  # Safe with WAL, fsyncs only at checkpoints
+    "cache_size": -8000,  # In KiB when negative
+    "mmap_size": 64 * 1024 * 1024,
+}
+DB_CACHED_STATEMENTS = 256
+
+LOG_FILE = 'error.log'
+LOG_MAX_BYTES = 1024 * 1024  # Rotate the log file past this size
+LOG_BACKUPS = 3
+LOG_BUFFER_RECORDS = 200  # Records held in memory between writes
+LOG_FLUSH_INTERVAL = 2.0  # Seconds between background flushes
+LOG_REPEAT_WINDOW = 60.0  # Identical messages inside this window are folded into one
+LOG_REPEAT_KEYS = 256
+
 COLOR_MAP = {
     "black": curses.COLOR_BLACK,
     "red": curses.COLOR_RED,
@@ -34,14 +55,163 @@ THEMES = {
 
 COMMANDS = [":d ", ":p ", ":x ", ":q ", ":theme "]
 
+class RepeatFilter(logging.Filter):
+    # Drops a message seen again within LOG_REPEAT_WINDOW and counts it on the next one let through
+    def __init__(self, window=LOG_REPEAT_WINDOW):
+        super().__init__()
+        self.window = window
+        self.seen = {}  # (level, message) -> [time let through, suppressed count, last suppressed record]
+        self.evicted = []  # Summaries for keys pushed out while they still had a count
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        key = (record.levelno, record.getMessage())
+        with self.lock:
+            entry = self.seen.pop(key, None)
+            if entry and record.created - entry[0] < self.window:
+                entry[1] += 1
+                entry[2] = record
+                self.seen[key] = entry
+                return False
+            if entry and entry[1]:
+                record.msg = f"{key[1]} (repeated {entry[1]} more times)"
+                record.args = None
+            self.seen[key] = [record.created, 0, None]
+            if len(self.seen) > LOG_REPEAT_KEYS:
+                oldest = next(iter(self.seen))
+                entry = self.seen.pop(oldest)
+                if entry[1]:
+                    self.evicted.append(self.summary(oldest, entry))
+        return True
+
+    def pending(self):
+        # Counts not reported yet, so a flush or close does not lose them
+        with self.lock:
+            records, self.evicted = self.evicted, []
+            for key, entry in self.seen.items():
+                if entry[1]:
+                    records.append(self.summary(key, entry))
+                    entry[1] = 0
+        return records
+
+    @staticmethod
+    def summary(key, entry):
+        record = entry[2]
+        record.msg = f"{key[1]} (repeated {entry[1]} more times)"
+        record.args = None
+        return record
+
+class RepeatBuffer(logging.handlers.MemoryHandler):
+    # Writes out what RepeatFilter still holds on every flush, including the one on close
+    def __init__(self, capacity, repeats, **kwargs):
+        super().__init__(capacity, **kwargs)
+        self.repeats = repeats
+        self.addFilter(repeats)
+
+    def flush(self):
+        with self.lock:
+            self.buffer.extend(self.repeats.pending())
+            super().flush()
+
+def flush_periodically(handler, interval=LOG_FLUSH_INTERVAL):
+    while True:
+        time.sleep(interval)
+        handler.flush()
+
+def setup_logger(path=LOG_FILE):
+    logger = logging.getLogger("todo")
+    if logger.handlers:
+        return logger
+    file_handler = logging.handlers.RotatingFileHandler(
+        path, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUPS, encoding="utf-8", delay=True)
+    file_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s [%(threadName)s] %(message)s"))
+    # Only CRITICAL is written straight away, everything else waits for the buffer or the flusher
+    buffer = RepeatBuffer(LOG_BUFFER_RECORDS, RepeatFilter(), flushLevel=logging.CRITICAL, target=file_handler)
+    logger.addHandler(buffer)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    threading.Thread(target=flush_periodically, args=(buffer,), name="log-flush", daemon=True).start()
+    return logger
+
 def strikethrough(text):
     return ''.join(c + '\u0336' for c in text)
 
+def parse_indices(text):
+    # 1,3,5 or 2-6, as 0-based list positions
+    indices = []
+    for part in text.split(','):
+        if '-' in part:
+            start, end = map(int, part.split('-'))
+            indices.extend(range(start - 1, end))
+        else:
+            indices.append(int(part) - 1)
+    return indices
+
+def open_database(db_file):
+    conn = sqlite3.connect(db_file, cached_statements=DB_CACHED_STATEMENTS)
+    for name, value in DB_PRAGMAS.items():
+        conn.execute(f"PRAGMA {name}={value}")
+    return conn
+
+class ChangeTracker:
+    # Rows touched since the last save, so save_todos only writes what changed
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.inserted_todos = {}  # todo_id -> content
+        self.updated_todos = set()
+        self.deleted_todos = set()
+        self.inserted_subtodos = {}  # subtodo_id -> (parent_id, content)
+        self.updated_subtodos = {}  # subtodo_id -> parent_id
+        self.deleted_subtodos = set()
+
+    def has_changes(self):
+        return bool(self.inserted_todos or self.updated_todos or self.deleted_todos or
+                    self.inserted_subtodos or self.updated_subtodos or self.deleted_subtodos)
+
+    def insert_todo(self, todo_id, content):
+        self.inserted_todos[todo_id] = content
+
+    def update_todo(self, todo_id):
+        if todo_id not in self.inserted_todos and todo_id not in self.deleted_todos:
+            self.updated_todos.add(todo_id)
+
+    def delete_todo(self, todo_id, subtodo_ids=()):
+        self.updated_todos.discard(todo_id)
+        if todo_id in self.inserted_todos:
+            del self.inserted_todos[todo_id]
+        else:
+            self.deleted_todos.add(todo_id)
+        # Pending writes for its children are superseded by the parent delete
+        for subtodo_id in subtodo_ids:
+            self.inserted_subtodos.pop(subtodo_id, None)
+            self.updated_subtodos.pop(subtodo_id, None)
+
+    def insert_subtodo(self, parent_id, subtodo_id, content):
+        self.inserted_subtodos[subtodo_id] = (parent_id, content)
+
+    def update_subtodo(self, parent_id, subtodo_id):
+        if subtodo_id not in self.inserted_subtodos and subtodo_id not in self.deleted_subtodos:
+            self.updated_subtodos[subtodo_id] = parent_id
+
+    def delete_subtodo(self, subtodo_id):
+        self.updated_subtodos.pop(subtodo_id, None)
+        if subtodo_id in self.inserted_subtodos:
+            del self.inserted_subtodos[subtodo_id]
+        else:
+            self.deleted_subtodos.add(subtodo_id)
+
 class ToDoApp:
     def __init__(self, stdscr):
         self.stdscr = stdscr
+        self.log = setup_logger()
         self.todos = []
-        self.highlighted = set()
+        self.todo_ids = []  # Database id of each todo, parallel to self.todos
+        self.next_todo_id = 1
+        self.changes = ChangeTracker()
+        self.conn = None
+        self.highlighted = set()  # Todo ids, so flags stay put when rows move
         self.priorities = set()
         self.current_theme = "dark"  # Default theme
         self.init_colors()
@@ -68,9 +238,19 @@ class ToDoApp:
             self.background_color_pair = curses.color_pair(2)  # Use the same as text background
             self.current_theme = theme_name
 
+    def get_connection(self):
+        if self.conn is None:
+            self.conn = open_database(DB_FILE)
+        return self.conn
+
+    def close_connection(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
     def load_todos(self):
         try:
-            conn = sqlite3.connect(DB_FILE)
+            conn = self.get_connection()
             cursor = conn.cursor()
             cursor.execute('''CREATE TABLE IF NOT EXISTS todos (
                                 id INTEGER PRIMARY KEY,
@@ -81,26 +261,36 @@ class ToDoApp:
             rows = cursor.fetchall()
             for row in rows:
                 self.todos.append(row[1])
+                self.todo_ids.append(row[0])
+                self.next_todo_id = max(self.next_todo_id, row[0] + 1)
                 if row[2]:
-                    self.highlighted.add(len(self.todos) - 1)
+                    self.highlighted.add(row[0])
                 if row[3]:
-                    self.priorities.add(len(self.todos) - 1)
-            conn.close()
+                    self.priorities.add(row[0])
         except Exception as e:
-            self.log_error(f"Error loading todos: {e}")
+            self.log.error(f"Error loading todos: {e}")
 
     def save_todos(self):
+        if not self.changes.has_changes():
+            return
         try:
-            conn = sqlite3.connect(DB_FILE)
-            cursor = conn.cursor()
-            cursor.execute('DELETE FROM todos')
-            for i, todo in enumerate(self.todos):
-                cursor.execute('INSERT INTO todos (content, highlighted, priority) VALUES (?, ?, ?)',
-                               (todo, int(i in self.highlighted), int(i in self.priorities)))
-            conn.commit()
-            conn.close()
+            changes = self.changes
+            conn = self.get_connection()
+            with conn:  # One transaction, one commit
+                cursor = conn.cursor()
+                cursor.executemany('DELETE FROM todos WHERE id = ?',
+                                   [(todo_id,) for todo_id in changes.deleted_todos])
+                cursor.executemany('INSERT INTO todos (id, content, highlighted, priority) VALUES (?, ?, ?, ?)',
+                                   [(todo_id, todo) + self.todo_flags(todo_id)
+                                    for todo_id, todo in changes.inserted_todos.items()])
+                cursor.executemany('UPDATE todos SET highlighted = ?, priority = ? WHERE id = ?',
+                                   [self.todo_flags(todo_id) + (todo_id,) for todo_id in changes.updated_todos])
+            changes.clear()
         except Exception as e:
-            self.log_error(f"Error saving todos: {e}")
+            self.log.error(f"Error saving todos: {e}")
+
+    def todo_flags(self, todo_id):
+        return (int(todo_id in self.highlighted), int(todo_id in self.priorities))
 
     def fill_background(self):
         try:
@@ -108,7 +298,7 @@ class ToDoApp:
             for y in range(height):
                 self.stdscr.addstr(y, 0, " " * width, self.background_color_pair)
         except Exception as e:
-            self.log_error(f"Error filling background: {e}")
+            self.log.error(f"Error filling background: {e}")
 
     def draw(self, input_str="", suggestions=None, selected_suggestion_index=None):
         try:
@@ -117,12 +307,12 @@ class ToDoApp:
             height, width = self.stdscr.getmaxyx()
 
             # Draw todos
-            for i, todo in enumerate(self.todos):
+            for i, (todo_id, todo) in enumerate(zip(self.todo_ids, self.todos)):
                 attr = self.text_color
                 display_text = todo
-                if i in self.priorities:
+                if todo_id in self.priorities:
                     attr |= curses.A_BOLD
-                if i in self.highlighted:
+                if todo_id in self.highlighted:
                     display_text = strikethrough(todo)
                     line_number = "✔"
                 else:
@@ -146,30 +336,49 @@ class ToDoApp:
             self.stdscr.clrtoeol()  # Clear the rest of the line
             self.stdscr.refresh()
         except Exception as e:
-            self.log_error(f"Error drawing screen: {e}")
+            self.log.error(f"Error drawing screen: {e}")
 
     def add_item(self, item):
         self.todos.append(item)
+        self.todo_ids.append(self.next_todo_id)
+        self.changes.insert_todo(self.next_todo_id, item)
+        self.next_todo_id += 1
 
     def highlight_item(self, idx):
-        if idx in self.highlighted:
-            self.highlighted.remove(idx)
-        else:
-            self.highlighted.add(idx)
+        self.toggle_mark(idx, self.highlighted)
 
     def prioritize_item(self, idx):
-        if idx in self.priorities:
-            self.priorities.remove(idx)
-        else:
-            self.priorities.add(idx)
+        self.toggle_mark(idx, self.priorities)
+
+    def toggle_mark(self, idx, marks):
+        if 0 <= idx < len(self.todo_ids):
+            todo_id = self.todo_ids[idx]
+            if todo_id in marks:
+                marks.remove(todo_id)
+            else:
+                marks.add(todo_id)
+            self.changes.update_todo(todo_id)
 
     def delete_items(self, indices):
-        indices = sorted(indices, reverse=True)
+        # Positions are resolved to ids up front, then the lists are rebuilt in one pass
+        doomed = {self.todo_ids[idx] for idx in indices if 0 <= idx < len(self.todo_ids)}
+        if not doomed:
+            return
+        kept = [i for i, todo_id in enumerate(self.todo_ids) if todo_id not in doomed]
+        self.todos = [self.todos[i] for i in kept]
+        self.todo_ids = [self.todo_ids[i] for i in kept]
+        for todo_id in doomed:
+            self.changes.delete_todo(todo_id)
+        self.highlighted -= doomed
+        self.priorities -= doomed
+
+    def toggle_items(self, indices, marks, toggle):
+        # The batch ends up marked, or unmarked when every item in it already was
+        indices = [idx for idx in dict.fromkeys(indices) if 0 <= idx < len(self.todos)]
+        setting = not all(self.todo_ids[idx] in marks for idx in indices)
         for idx in indices:
-            if idx < len(self.todos):
-                del self.todos[idx]
-        self.highlighted = {i if i < idx else i - len(indices) for i in self.highlighted if i not in indices}
-        self.priorities = {i if i < idx else i - len(indices) for i in self.priorities if i not in indices}
+            if (self.todo_ids[idx] in marks) != setting:
+                toggle(idx)
 
     def handle_input(self, input_str):
         try:
@@ -178,27 +387,17 @@ class ToDoApp:
                 self.highlight_item(idx)
             elif input_str.startswith(":d "):
                 try:
-                    idx = int(input_str[3:]) - 1
-                    self.highlight_item(idx)
+                    self.toggle_items(parse_indices(input_str[3:]), self.highlighted, self.highlight_item)
                 except ValueError:
                     pass
             elif input_str.startswith(":p "):
                 try:
-                    idx = int(input_str[3:]) - 1
-                    self.prioritize_item(idx)
+                    self.toggle_items(parse_indices(input_str[3:]), self.priorities, self.prioritize_item)
                 except ValueError:
                     pass
             elif input_str.startswith(":x "):
                 try:
-                    ranges = input_str[3:].split(',')
-                    indices = []
-                    for range_str in ranges:
-                        if '-' in range_str:
-                            start, end = map(int, range_str.split('-'))
-                            indices.extend(range(start-1, end))
-                        else:
-                            indices.append(int(range_str) - 1)
-                    self.delete_items(indices)
+                    self.delete_items(parse_indices(input_str[3:]))
                 except ValueError:
                     pass
             elif input_str.startswith(":theme "):
@@ -206,13 +405,14 @@ class ToDoApp:
                 self.apply_theme(theme_name)
             elif input_str.strip() == ":q":
                 self.save_todos()
+                self.close_connection()
                 return False  # Signal to exit the app
             else:
                 self.add_item(input_str)
             self.save_todos()  # Save todos after each modification
             return True
         except Exception as e:
-            self.log_error(f"Error handling input: {e}")
+            self.log.error(f"Error handling input: {e}")
             return True
 
     def get_suggestions(self, input_str):
@@ -220,10 +420,6 @@ class ToDoApp:
             return [cmd for cmd in COMMANDS if cmd.startswith(input_str)]
         return []
 
-    def log_error(self, message):
-        with open("error.log", "a") as log_file:
-            log_file.write(message + "\n")
-
     def run(self):
         curses.echo()
         input_str = ""
@@ -267,8 +463,7 @@ def main(stdscr):
     try:
         app = ToDoApp(stdscr)
     except Exception as e:
-        with open("error.log", "a") as log_file:
-            log_file.write(f"Critical error: {e}\n")
+        setup_logger().critical(f"Critical error: {e}")
 
 curses.wrapper(main)
 